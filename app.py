@@ -1,8 +1,47 @@
 import os
+import sys
+import io
+import csv
 import json
+import hashlib
+import hmac
+import struct
+import zlib
+import contextlib
+import functools
+import time
+import bisect
+import itertools
+import atexit
+import sqlite3
+import tempfile
 import logging
-from datetime import datetime
-from flask import Flask, render_template, request, send_file
+import threading
+import queue
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from collections import OrderedDict, Counter, deque
+from collections.abc import Mapping
+from datetime import datetime, timezone
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+try:
+    import numpy
+except ImportError:  # only needed by the columnar analytics engine
+    numpy = None
+try:
+    from pypdf import PdfWriter
+except ImportError:  # only needed to merge batch PDFs into one file
+    PdfWriter = None
+import click
+from flask import Flask, request, send_file, jsonify, url_for, g, has_request_context
+from flask import render_template as flask_render_template
+from werkzeug.http import is_resource_modified
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.pdfgen import canvas
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -28,52 +67,2917 @@ logging.basicConfig(
 def log_request():
     app.logger.info("Request: %s %s from %s", request.method, request.path, request.remote_addr)
 
+# ---------------- Instrumentation ----------------
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Requests slower than this many seconds get their sampled profile written
+# to PROFILE_DIR; unset (or 0) turns the sampling profiler off.
+PROFILE_SLOW_REQUESTS = float(os.environ.get("PROFILE_SLOW_REQUESTS", "0"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+# /metrics answers only loopback clients unless this is set. The check sees
+# the connecting socket's address, so it assumes clients connect directly:
+# behind a reverse proxy on the same host every client looks local.
+METRICS_ALLOW_REMOTE = os.environ.get("METRICS_ALLOW_REMOTE", "") not in ("", "0")
+# When set, /metrics instead requires "Authorization: Bearer <token>" from
+# every client, wherever it connects from; use it behind a proxy.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        bucket = bisect.bisect_left(self.buckets, value)
+        if bucket < len(self.buckets):
+            self.counts[bucket] += 1
+        self.count += 1
+        self.sum += value
+
+
+class RequestMetrics:
+    """Per-route latency histograms, split into phases, plus request counts by status.
+
+    The phases are "total", "render" (templates), "pdf" (PDF builds), "save"
+    (persisting records) and "compute" (the rest of the request). Work
+    done outside a request, like the group-commit flusher, is filed under
+    the route "background".
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.responses = Counter()
+        self.response_bytes = Counter()
+
+    def observe(self, route, phase, seconds):
+        with self.lock:
+            histogram = self.latency.get((route, phase))
+            if histogram is None:
+                histogram = self.latency[(route, phase)] = Histogram()
+            histogram.observe(seconds)
+
+    def finish(self, route, status, size, phases):
+        total = phases.pop("total")
+        phases["compute"] = max(0.0, total - sum(phases.values()))
+        phases["total"] = total
+        with self.lock:
+            self.responses[(route, status)] += 1
+            if size is not None:
+                self.response_bytes[route] += size
+        for phase, seconds in phases.items():
+            self.observe(route, phase, seconds)
+
+
+request_metrics = RequestMetrics()
+
+@contextlib.contextmanager
+def timed(phase):
+    """Charge the time spent in the block to phase of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if has_request_context() and "phase_times" in g:
+            g.phase_times[phase] = g.phase_times.get(phase, 0.0) + elapsed
+        else:
+            request_metrics.observe("background", phase, elapsed)
+
+def render_template(*args, **kwargs):
+    with timed("render"):
+        return flask_render_template(*args, **kwargs)
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads serving requests every PROFILE_INTERVAL seconds.
+
+    Each request's samples are kept as collapsed stacks ("outer;inner
+    count", the flame graph input format) and written out only if the
+    request turns out slower than PROFILE_SLOW_REQUESTS.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {}
+        self.lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start_request(self):
+        """Start sampling this thread, first starting this process's sampler thread if needed."""
+        if self._pid != os.getpid():
+            with self.lock:
+                if self._pid != os.getpid():
+                    self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+        self.active[threading.get_ident()] = Counter()
+
+    def forget_thread(self):
+        """Drop the inherited lock in a freshly forked worker; its first request starts a sampler."""
+        self.lock = threading.Lock()
+
+    def finish_request(self):
+        return self.active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, samples in list(self.active.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    samples[";".join(reversed(stack))] += 1
+
+    @staticmethod
+    def dump(route, seconds, samples):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{route.strip('/').replace('/', '_') or 'index'}.folded"
+        path = os.path.join(PROFILE_DIR, name)
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        app.logger.info("Slow request %s took %.3fs; profile written to %s", route, seconds, path)
+
+
+profiler = SamplingProfiler(PROFILE_INTERVAL) if PROFILE_SLOW_REQUESTS > 0 else None
+
+def request_route():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.phase_times = {}
+    if profiler is not None:
+        profiler.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    phases = dict(g.pop("phase_times", {}))
+    phases["total"] = time.perf_counter() - g.pop("request_started", time.perf_counter())
+    route = request_route()
+    size = None if response.is_streamed else response.calculate_content_length()
+    request_metrics.finish(route, response.status_code, size, phases)
+    if profiler is not None:
+        samples = profiler.finish_request()
+        if samples and phases["total"] >= PROFILE_SLOW_REQUESTS:
+            profiler.dump(route, phases["total"], samples)
+    return response
+
 # Set the data file path relative to BASE_DIR.
 DATA_FILE = os.path.join(BASE_DIR, 'data.json')
 
+# ---------------- Storage ----------------
+# The four record lists persisted in the snapshot (DATA_FILE or BINARY_SNAPSHOT_FILE).
+RECORD_KINDS = ("sales_records", "purchase_records", "sale_return_records", "purchase_return_records")
+
+# "journal" appends each new record to JOURNAL_FILE and periodically compacts
+# the journal into the snapshot; "json" rewrites the snapshot on every write.
+# "sqlite" keeps records in SQLITE_FILE instead (importing the snapshot on first use).
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "journal")
+SQLITE_FILE = os.path.join(BASE_DIR, 'data.sqlite3')
+JOURNAL_FILE = os.path.join(BASE_DIR, 'data.journal')
+# fsync the journal after this many appends or this many seconds, whichever comes first.
+JOURNAL_FSYNC_EVERY = int(os.environ.get("JOURNAL_FSYNC_EVERY", "16"))
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get("JOURNAL_FSYNC_INTERVAL", "1.0"))
+# Fold the journal into a fresh snapshot once it holds this many entries.
+JOURNAL_COMPACT_EVERY = int(os.environ.get("JOURNAL_COMPACT_EVERY", "1000"))
+# Snapshot format written by the journal and json backends: "json" (DATA_FILE)
+# or "binary", a compact columnar file (BINARY_SNAPSHOT_FILE). Whichever
+# snapshot file is newer is the one loaded, so switching formats converts
+# the data on the next save.
+SNAPSHOT_FORMAT = os.environ.get("SNAPSHOT_FORMAT", "json")
+BINARY_SNAPSHOT_FILE = os.path.join(BASE_DIR, 'data.snapshot')
+SNAPSHOT_FILES = {"json": DATA_FILE, "binary": BINARY_SNAPSHOT_FILE}
+SNAPSHOT_FILE = SNAPSHOT_FILES[SNAPSHOT_FORMAT]
+# Held by whichever worker process is writing.
+LOCK_FILE = os.path.join(BASE_DIR, 'data.lock')
+# When a new record counts as written: "sync" persists it (fsynced) inside the request;
+# "batched" queues it and waits for the group commit that persists it (fsynced);
+# "async" queues it and answers at once, the record showing up once flushed.
+WRITE_DURABILITY = os.environ.get("WRITE_DURABILITY", "sync")
+# A queued batch is committed once it holds this many records or is this many seconds old.
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", "256"))
+WRITE_BATCH_INTERVAL = float(os.environ.get("WRITE_BATCH_INTERVAL", "0.05"))
+
+
+class RecordJournal:
+    """Append-only JSON-lines log of records added since the last snapshot.
+
+    Every line is {"seq": n, "kind": <record list>, "record": {...}}. The
+    snapshot remembers the last seq it contains, so entries that were already
+    compacted are skipped on replay even if rotating the journal failed.
+    Compaction moves the journal aside to <path>.1 and starts a new one with
+    a {"base_seq": n} header naming the snapshot it follows. offset is how far
+    this process has read, so other workers' appends can be picked up with
+    tail(), and a worker that had not finished reading the previous journal
+    when it was compacted can still finish it from <path>.1.
+
+    Appends are fsynced once fsync_every of them are pending, or by a timer
+    fsync_interval seconds after the first pending one, so a burst followed
+    by silence is not left unsynced until the next write.
+    """
+
+    def __init__(self, path, fsync_every=16, fsync_interval=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.seq = 0
+        self.entries = 0
+        self.offset = 0
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # Guards the file handle against the fsync timer thread.
+        self._lock = threading.RLock()
+        self._timer = None
+
+    def replay(self, after_seq=0):
+        """Yield (kind, record) for every journal entry newer than after_seq.
+
+        Must run under write_lock: a torn final line, which is what an
+        interrupted append leaves behind, is cut off the file.
+        """
+        self.seq = after_seq
+        self.entries = 0
+        self.offset = 0
+        if not os.path.exists(self.path):
+            return
+        for _, kind, record in self._read(after_seq, self.path):
+            yield kind, record
+        if os.path.getsize(self.path) > self.offset:
+            app.logger.warning("Discarding torn last line of %s", self.path)
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.offset)
+
+    def tail(self, path=None):
+        """(kind, record) entries other processes appended since this one last read.
+
+        Returns None if they cannot be read without a gap in seq, e.g. the
+        journal was compacted past what this process has seen.
+        """
+        path = path or self.path
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        if size < self.offset:
+            return None
+        if size == self.offset:
+            return []
+        entries = []
+        for seq, kind, record in self._read(self.seq, path):
+            if seq != self.seq:
+                return None
+            entries.append((kind, record))
+        return entries
+
+    def base_seq(self):
+        """seq of the snapshot the current journal follows, from its header (0 if none)."""
+        try:
+            with open(self.path, 'rb') as f:
+                header = json.loads(f.readline() or b"{}")
+        except (OSError, ValueError):
+            return 0
+        return header.get("base_seq", 0)
+
+    def _read(self, after_seq, path):
+        """Yield (seq, kind, record) for complete lines past offset with seq > after_seq.
+
+        self.seq advances one step per entry, so callers can spot a jump.
+        """
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Still being written by another process, or torn.
+                    break
+                position = self.offset
+                self.offset += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    app.logger.warning("Skipping unreadable journal line at byte %s of %s", position, path)
+                    continue
+                if "seq" not in entry:
+                    continue
+                self.entries += 1
+                if entry["seq"] <= after_seq:
+                    continue
+                expected = self.seq + 1
+                self.seq = entry["seq"]
+                yield expected, entry["kind"], entry["record"]
+
+    def append(self, kind, record):
+        """Write one record to the journal; fsync in batches."""
+        self.append_many([(kind, record)])
+
+    def append_many(self, entries, durable=False):
+        """Write (kind, record) pairs to the journal in one write.
+
+        With durable the journal is fsynced before returning; otherwise it
+        is fsynced in batches.
+        """
+        lines = []
+        for kind, record in entries:
+            self.seq += 1
+            lines.append(json.dumps({"seq": self.seq, "kind": kind, "record": dict(record)}).encode("utf-8") + b"\n")
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            self.offset = self._file.tell()
+            self.entries += len(lines)
+            self._unsynced += len(lines)
+            if (durable or self._unsynced >= self.fsync_every or
+                    time.monotonic() - self._last_sync >= self.fsync_interval):
+                self.sync()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.fsync_interval, self._timed_sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def sync(self):
+        """Force buffered journal writes to disk."""
+        with self._lock:
+            if self._file is not None and self._unsynced:
+                os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def _timed_sync(self):
+        with self._lock:
+            self._timer = None
+            self.sync()
+
+    def rotate(self):
+        """Start an empty journal once the entries are safely in the snapshot.
+
+        The old journal is kept as <path>.1 for workers still reading it.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.replace(self.path, self.path + ".1")
+        header = json.dumps({"base_seq": self.seq}).encode("utf-8") + b"\n"
+        with open(self.path, 'wb') as f:
+            f.write(header)
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries = 0
+        self.offset = len(header)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self.sync()
+                self._file.close()
+                self._file = None
+
+    def forget_file(self):
+        """Drop the inherited file handle and timer in a freshly forked worker."""
+        self._lock = threading.RLock()
+        self._timer = None
+        self._file = None
+        self._unsynced = 0
+
+
+class WriteLock:
+    """Serializes writers across threads (an RLock) and worker processes (a lock file).
+
+    Re-entrant within a thread. The lock file is opened per process, since
+    flock() locks shared through fork() would not exclude anything.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        self._pid = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            if self._depth == 0:
+                self._lock_file()
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                self._unlock_file()
+        finally:
+            self._thread_lock.release()
+
+    def _lock_file(self):
+        if self._file is None or self._pid != os.getpid():
+            self._file = open(self.path, 'a+b')
+            self._pid = os.getpid()
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ten seconds; keep waiting.
+                    continue
+
+    def _unlock_file(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+journal = RecordJournal(JOURNAL_FILE, JOURNAL_FSYNC_EVERY, JOURNAL_FSYNC_INTERVAL)
+atexit.register(journal.close)
+write_lock = WriteLock(LOCK_FILE)
+
+def snapshot_stat():
+    """Identity of the current SNAPSHOT_FILE, to notice another process replacing it."""
+    try:
+        st = os.stat(SNAPSHOT_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def newest_snapshot():
+    """Path of the most recently written snapshot file, or None if there is none."""
+    existing = [path for path in SNAPSHOT_FILES.values() if os.path.exists(path)]
+    return max(existing, key=os.path.getmtime, default=None)
+
+# Binary snapshot layout: header (magic, format version, body length, CRC-32 of the body),
+# then the body: the journal seq, and per record list its record count, an
+# "id" column and one column per field, then the irregular records as JSON.
+# Numbers are stored as little-endian int64 or float64 arrays; text columns
+# as a table of the distinct strings plus an int32 index per record.
+BINARY_SNAPSHOT_MAGIC = b"LEDGSNAP"
+BINARY_SNAPSHOT_VERSION = 1
+BINARY_SNAPSHOT_HEADER = struct.Struct("<8sHQI")
+
+
+def _array_bytes(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return struct.pack("<Q", len(values)) + values.tobytes()
+
+def _read_array(typecode, payload, offset):
+    (count,) = struct.unpack_from("<Q", payload, offset)
+    offset += 8
+    values = array(typecode)
+    values.frombytes(payload[offset:offset + count * values.itemsize])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values, offset + count * values.itemsize
+
+def _blob_bytes(blob):
+    return struct.pack("<Q", len(blob)) + blob
+
+def _read_blob(payload, offset):
+    (size,) = struct.unpack_from("<Q", payload, offset)
+    offset += 8
+    return payload[offset:offset + size], offset + size
+
+def _column_type(values):
+    """Typecode of a numeric column: "d" unless every value is an int."""
+    return "q" if all(type(value) is int for value in values) else "d"
+
+def encode_snapshot(records, journal_seq):
+    """Binary snapshot bytes for {kind: [records]}.
+
+    Records holding exactly the fields of their kind, with values of the
+    column's type, go into the columns; the rest (extra or missing fields,
+    odd value types) are kept whole as JSON, so every record comes back
+    exactly as it was.
+    """
+    body = [struct.pack("<Q", journal_seq)]
+    for kind in RECORD_KINDS:
+        fields = ("id",) + RECORD_FIELDS[kind]
+        plain = [rec for rec in records[kind] if rec._extra is None]
+        types = {field: "q" if field == "id" else _column_type([rec.get(field) for rec in plain])
+                 for field in fields if field == "id" or field in NUMERIC_FIELDS}
+        wanted = tuple({"q": int, "d": float}[types[field]] if field in types else str for field in fields)
+        columnar, irregular = [], []
+        for position, rec in enumerate(records[kind]):
+            if rec._extra is None and tuple(type(rec.get(field)) for field in fields) == wanted:
+                columnar.append(rec)
+            else:
+                irregular.append([position, dict(rec)])
+        body.append(struct.pack("<Q", len(columnar)))
+        for field in fields:
+            values = [rec[field] for rec in columnar]
+            if field in types:
+                body.append(types[field].encode("ascii") + _array_bytes(array(types[field], values)))
+                continue
+            strings = {}
+            indexes = array("i", (strings.setdefault(value, len(strings)) for value in values))
+            encoded = [value.encode("utf-8") for value in strings]
+            body.append(b"s" + _array_bytes(array("q", map(len, encoded))) + _blob_bytes(b"".join(encoded))
+                        + _array_bytes(indexes))
+        body.append(_blob_bytes(json.dumps(irregular, separators=(",", ":")).encode("utf-8")))
+    body = b"".join(body)
+    header = BINARY_SNAPSHOT_HEADER.pack(BINARY_SNAPSHOT_MAGIC, BINARY_SNAPSHOT_VERSION, len(body), zlib.crc32(body))
+    return header + body
+
+def decode_snapshot(payload):
+    """({kind: [records]}, journal seq) from binary snapshot bytes.
+
+    Raises ValueError if the bytes are not a snapshot this version reads,
+    or do not match their checksum.
+    """
+    if len(payload) < BINARY_SNAPSHOT_HEADER.size:
+        raise ValueError("Binary snapshot is truncated")
+    magic, version, size, checksum = BINARY_SNAPSHOT_HEADER.unpack_from(payload)
+    if magic != BINARY_SNAPSHOT_MAGIC:
+        raise ValueError("Not a binary snapshot")
+    if version != BINARY_SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported binary snapshot version {version}")
+    body = memoryview(payload)[BINARY_SNAPSHOT_HEADER.size:]
+    if len(body) != size or zlib.crc32(body) != checksum:
+        raise ValueError("Binary snapshot does not match its checksum")
+    (journal_seq,) = struct.unpack_from("<Q", body)
+    offset = 8
+    data = {}
+    for kind in RECORD_KINDS:
+        fields = ("id",) + RECORD_FIELDS[kind]
+        (count,) = struct.unpack_from("<Q", body, offset)
+        offset += 8
+        columns = []
+        for field in fields:
+            typecode = chr(body[offset])
+            offset += 1
+            if typecode != "s":
+                values, offset = _read_array(typecode, body, offset)
+                columns.append(values.tolist())
+                continue
+            lengths, offset = _read_array("q", body, offset)
+            blob, offset = _read_blob(body, offset)
+            indexes, offset = _read_array("i", body, offset)
+            strings, start = [], 0
+            for length in lengths:
+                strings.append(sys.intern(str(blob[start:start + length], "utf-8")))
+                start += length
+            columns.append([strings[i] for i in indexes])
+        records = RECORD_TYPES[kind].from_columns(columns)
+        blob, offset = _read_blob(body, offset)
+        for position, fields_ in json.loads(bytes(blob)):
+            records.insert(position, make_record(kind, fields_))
+        data[kind] = records
+    return data, journal_seq
+
+def read_snapshot(path):
+    """({kind: [records]}, journal seq) from a snapshot file in either format."""
+    with open(path, 'rb') as f:
+        payload = f.read()
+    if payload.startswith(BINARY_SNAPSHOT_MAGIC):
+        return decode_snapshot(payload)
+    snapshot = json.loads(payload)
+    data = {kind: [make_record(kind, rec) for rec in snapshot.get(kind, [])] for kind in RECORD_KINDS}
+    return data, snapshot.get("journal_seq", 0)
+
+def write_snapshot(path, fmt, records, journal_seq):
+    """Write {kind: [records]} as a snapshot in fmt ("json" or "binary").
+
+    The snapshot is written to a temporary file and renamed into place, so a
+    crash mid-write never leaves a truncated snapshot behind.
+    """
+    if fmt == "binary":
+        payload = encode_snapshot(records, journal_seq)
+    else:
+        data = {kind: [rec.as_dict() for rec in records[kind]] for kind in RECORD_KINDS}
+        data["journal_seq"] = journal_seq
+        payload = json.dumps(data, indent=4).encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 def load_data():
-    """Load all records from the JSON file. If not found, initialize empty data."""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
-        app.logger.info("Data loaded from %s", DATA_FILE)
-        return {
-            "sales_records": data.get("sales_records", []),
-            "purchase_records": data.get("purchase_records", []),
-            "sale_return_records": data.get("sale_return_records", []),
-            "purchase_return_records": data.get("purchase_return_records", [])
-        }
+    """Load all records from the newest snapshot and replay the journal on top of it.
+    If neither exists, initialize empty data."""
+    data = {kind: [] for kind in RECORD_KINDS}
+    snapshot_seq = 0
+    path = newest_snapshot()
+    if path is not None:
+        data, snapshot_seq = read_snapshot(path)
+        app.logger.info("Data loaded from %s", path)
     else:
         app.logger.info("No data file found; initializing empty data")
+
+    replayed = 0
+    for kind, record in journal.replay(snapshot_seq):
+        data[kind].append(make_record(kind, record))
+        replayed += 1
+    if replayed:
+        app.logger.info("Replayed %s journal entries from %s", replayed, JOURNAL_FILE)
+    return data
+
+def save_data():
+    """Save the current records to SNAPSHOT_FILE in SNAPSHOT_FORMAT. Callers hold write_lock."""
+    write_snapshot(SNAPSHOT_FILE, SNAPSHOT_FORMAT, store.records, journal.seq)
+    store.snapshot = snapshot_stat()
+    app.logger.info("Data saved to %s", SNAPSHOT_FILE)
+
+def compact_journal():
+    """Fold journal entries into a fresh snapshot and empty the journal."""
+    journal.sync()
+    save_data()
+    journal.rotate()
+    app.logger.info("Journal compacted into %s", SNAPSHOT_FILE)
+
+# Fields of each record type, in the order they are written to snapshots.
+RECORD_FIELDS = {
+    "sales_records": ("product_name", "sale_date", "unit_price", "quantity", "total_sale"),
+    "purchase_records": ("supplier_name", "product_name", "purchase_date", "unit_price", "quantity", "total_purchase"),
+    "sale_return_records": ("product_name", "return_date", "unit_price", "quantity", "refund_amount"),
+    "purchase_return_records": ("supplier_name", "product_name", "return_date", "unit_price", "quantity", "total_return")
+}
+NUMERIC_FIELDS = {"unit_price", "quantity", "total_sale", "total_purchase", "refund_amount", "total_return"}
+DATE_FIELDS = {
+    "sales_records": "sale_date",
+    "purchase_records": "purchase_date",
+    "sale_return_records": "return_date",
+    "purchase_return_records": "return_date"
+}
+# The money column of each record type.
+AMOUNT_FIELDS = {
+    "sales_records": "total_sale",
+    "purchase_records": "total_purchase",
+    "sale_return_records": "refund_amount",
+    "purchase_return_records": "total_return"
+}
+# Record types as named in import/export URLs and commands.
+URL_RECORD_KINDS = {
+    "sales": "sales_records",
+    "purchases": "purchase_records",
+    "sale-returns": "sale_return_records",
+    "purchase-returns": "purchase_return_records"
+}
+# Records shown per page on the listing pages, unless ?per_page= asks otherwise.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Name fields matched case-insensitively by the search boxes on /sale and /purchase.
+SEARCH_FIELDS = {
+    "sales_records": ("product_name",),
+    "purchase_records": ("product_name", "supplier_name")
+}
+
+
+# ---------------- Records ----------------
+def key_column(field):
+    """Name of the normalized key kept alongside a *_name field (a record attribute and SQLite column)."""
+    return field[:-len("_name")] + "_key"
+
+# Every date string seen so far -> its datetime (None if it does not parse),
+# so each distinct date is parsed once however many records carry it.
+_parsed_dates = {}
+
+def parse_date(date_str):
+    """datetime for a YYYY-MM-DD string, or None."""
+    try:
+        return _parsed_dates[date_str]
+    except KeyError:
+        pass
+    except TypeError:
+        return None
+    try:
+        parsed = datetime.strptime(date_str, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        parsed = None
+    _parsed_dates[date_str] = parsed
+    return parsed
+
+
+class Record(Mapping):
+    """One record, held in slots instead of a dict.
+
+    Reads like the dict it was built from (rec["field"], rec.get(...)), and
+    as_dict() gives that dict back for data.json and the journal. Each name
+    field also gets its normalized key (product_key, supplier_key) and the
+    date field is parsed once into parsed_date. Text values are interned,
+    so the many records naming one product or date share a single string.
+
+    id is the record's stable identifier, unique within its kind. The store
+    assigns it when it accepts the record; apart from that, records are
+    never modified after they are built.
+    """
+
+    __slots__ = ("id", "parsed_date", "_extra")
+    KIND = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = ("id",) + RECORD_FIELDS[cls.KIND]
+        cls.FIELD_SET = frozenset(cls.FIELDS)
+        cls.DATE_FIELD = DATE_FIELDS[cls.KIND]
+        cls.NAME_FIELDS = tuple(field for field in cls.FIELDS if field.endswith("_name"))
+
+    def __init__(self, fields):
+        """Build from a mapping (a dict or an sqlite3.Row); unknown keys are kept aside."""
+        extra = None
+        for field in fields.keys():
+            value = fields[field]
+            if type(value) is str:
+                value = sys.intern(value)
+            if field in self.FIELD_SET:
+                setattr(self, field, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[field] = value
+        self._extra = extra
+        for field in self.NAME_FIELDS:
+            value = getattr(self, field, "")
+            setattr(self, key_column(field), sys.intern(value.strip().lower()) if type(value) is str else "")
+        self.parsed_date = parse_date(getattr(self, self.DATE_FIELD, ""))
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Records from parallel columns of values, one per field of FIELDS.
+
+        Gives the same records as __init__ for complete rows of interned
+        values, but fills the slots a column at a time, deriving name keys
+        and parsed dates once per distinct value.
+        """
+        count = len(columns[0])
+        records = list(map(cls.__new__, itertools.repeat(cls, count)))
+        for field, column in zip(cls.FIELDS, columns):
+            deque(map(getattr(cls, field).__set__, records, column), maxlen=0)
+            if field in cls.NAME_FIELDS:
+                keys = {value: sys.intern(value.strip().lower()) for value in set(column)}
+                deque(map(getattr(cls, key_column(field)).__set__, records, map(keys.__getitem__, column)), maxlen=0)
+            if field == cls.DATE_FIELD:
+                deque(map(cls.parsed_date.__set__, records, map(parse_date, column)), maxlen=0)
+        deque(map(cls._extra.__set__, records, itertools.repeat(None)), maxlen=0)
+        return records
+
+    def __getitem__(self, field):
+        if field in self.FIELD_SET:
+            try:
+                return getattr(self, field)
+            except AttributeError:
+                raise KeyError(field) from None
+        if self._extra is not None and field in self._extra:
+            return self._extra[field]
+        raise KeyError(field)
+
+    def get(self, field, default=None):
+        if field in self.FIELD_SET:
+            return getattr(self, field, default)
+        if self._extra is not None:
+            return self._extra.get(field, default)
+        return default
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+    def as_dict(self):
+        data = {field: getattr(self, field) for field in self.FIELDS if hasattr(self, field)}
+        if self._extra is not None:
+            data.update(self._extra)
+        return data
+
+
+class SaleRecord(Record):
+    __slots__ = RECORD_FIELDS["sales_records"] + ("product_key",)
+    KIND = "sales_records"
+
+
+class PurchaseRecord(Record):
+    __slots__ = RECORD_FIELDS["purchase_records"] + ("supplier_key", "product_key")
+    KIND = "purchase_records"
+
+
+class SaleReturnRecord(Record):
+    __slots__ = RECORD_FIELDS["sale_return_records"] + ("product_key",)
+    KIND = "sale_return_records"
+
+
+class PurchaseReturnRecord(Record):
+    __slots__ = RECORD_FIELDS["purchase_return_records"] + ("supplier_key", "product_key")
+    KIND = "purchase_return_records"
+
+
+RECORD_TYPES = {cls.KIND: cls for cls in (SaleRecord, PurchaseRecord, SaleReturnRecord, PurchaseReturnRecord)}
+
+def make_record(kind, fields):
+    """The Record of kind for a mapping of field values (returned as is if it already is one)."""
+    if isinstance(fields, RECORD_TYPES[kind]):
+        return fields
+    return RECORD_TYPES[kind](fields)
+
+def assign_ids(records):
+    """Give records loaded without an id (written before ids existed) the next free one.
+
+    Ids only ever grow in storage order, so for old data each record's id
+    is its list position, which is what its invoice URL already used.
+    Returns the next id to hand out.
+    """
+    next_id = 0
+    for record in records:
+        if record.get("id") is None:
+            record.id = next_id
+        next_id = max(next_id, record.id + 1)
+    return next_id
+
+def json_default(value):
+    """json.dumps fallback that writes records as their dicts."""
+    if isinstance(value, Record):
+        return value.as_dict()
+    return str(value)
+
+
+class SubstringIndex:
+    """Finds the positions of records whose field value contains a substring.
+
+    Values repeat heavily (the same product, supplier or date is on many
+    records), so the index maps each distinct value to the positions of the
+    records carrying it, and every 1- to 3-character gram to the distinct
+    values containing it. A longer query intersects the value sets of its
+    trigrams and confirms each candidate with a real substring test, so the
+    matches are exactly those of `needle in value`.
+
+    Searches run while a writer may be adding values, so both go through
+    lock and a search works on its own copy of the matching values.
+    """
+
+    GRAM = 3
+
+    def __init__(self):
+        self.postings = {}
+        self.grams = {}
+        self.lock = threading.Lock()
+
+    def add(self, value, position):
+        with self.lock:
+            postings = self.postings.get(value)
+            if postings is None:
+                postings = array("L")
+                for n in range(1, self.GRAM + 1):
+                    for i in range(len(value) - n + 1):
+                        self.grams.setdefault(value[i:i + n], set()).add(value)
+                self.postings[value] = postings
+            postings.append(position)
+
+    def truncate(self, length):
+        """Forget every position from length on."""
+        with self.lock:
+            for postings in self.postings.values():
+                while postings and postings[-1] >= length:
+                    postings.pop()
+
+    def values_containing(self, needle):
+        with self.lock:
+            if len(needle) <= self.GRAM:
+                return list(self.grams.get(needle, ()))
+            value_sets = []
+            for i in range(len(needle) - self.GRAM + 1):
+                values = self.grams.get(needle[i:i + self.GRAM])
+                if not values:
+                    return []
+                value_sets.append(values)
+            value_sets.sort(key=len)
+            candidates = value_sets[0].intersection(*value_sets[1:])
+        return [value for value in candidates if needle in value]
+
+    def positions(self, needle):
+        """Posting arrays of every distinct value containing needle."""
+        return [self.postings[value] for value in self.values_containing(needle)]
+
+
+class JsonStore:
+    """Keeps every record in memory and persists them to SNAPSHOT_FILE.
+
+    New records go to the journal (STORAGE_BACKEND=journal) or trigger a full
+    rewrite of the snapshot (STORAGE_BACKEND=json).
+    """
+
+    def __init__(self):
+        self.load()
+
+    def load(self):
+        """(Re)load every record from disk and rebuild the lookup structures."""
+        journal.close()
+        self.snapshot = snapshot_stat()
+        self.records = load_data()
+        # Ids of sealed records are never handed out again.
+        self.next_id = {kind: max(assign_ids(self.records[kind]), archive.next_id[kind]) for kind in RECORD_KINDS}
+        if archive.months:
+            # Sealed records still here are left over from a seal that was
+            # interrupted before it rewrote the store.
+            for kind in RECORD_KINDS:
+                self.records[kind] = [rec for rec in self.records[kind] if not archive.holds(kind, rec)]
+        # Record id -> list position, per kind.
+        self.by_id = {
+            kind: {record.id: position for position, record in enumerate(self.records[kind])}
+            for kind in RECORD_KINDS
+        }
+        # (kind, field) -> SubstringIndex over that field, for the search boxes.
+        self.search_index = {
+            (kind, field): SubstringIndex()
+            for kind, fields in SEARCH_FIELDS.items()
+            for field in fields + (DATE_FIELDS[kind],)
+        }
+        for kind in SEARCH_FIELDS:
+            for position, record in enumerate(self.records[kind]):
+                self._index(kind, record, position)
+        # (date, position) of every record, sorted, for date-ordered paging.
+        self.date_order = {
+            kind: sorted((rec.get(DATE_FIELDS[kind], ""), position) for position, rec in enumerate(self.records[kind]))
+            for kind in RECORD_KINDS
+        }
+
+    def _index(self, kind, record, position):
+        for field in SEARCH_FIELDS[kind]:
+            self.search_index[(kind, field)].add(record.get(field, "").lower(), position)
+        date_field = DATE_FIELDS[kind]
+        self.search_index[(kind, date_field)].add(record.get(date_field, ""), position)
+
+    def _add(self, kind, record):
+        self.records[kind].append(record)
+        position = len(self.records[kind]) - 1
+        self.by_id[kind][record.id] = position
+        self.next_id[kind] = max(self.next_id[kind], record.id + 1)
+        if kind in SEARCH_FIELDS:
+            self._index(kind, record, position)
+        bisect.insort(self.date_order[kind], (record.get(DATE_FIELDS[kind], ""), position))
+
+    def _truncate(self, lengths, next_id):
+        """Undo _add: drop the records past lengths ({kind: length}) from every
+        lookup structure and restore next_id."""
+        for kind, length in lengths.items():
+            if len(self.records[kind]) == length:
+                continue
+            for record in self.records[kind][length:]:
+                self.by_id[kind].pop(record.id, None)
+            del self.records[kind][length:]
+            for (index_kind, _), index in self.search_index.items():
+                if index_kind == kind:
+                    index.truncate(length)
+            self.date_order[kind] = [entry for entry in self.date_order[kind] if entry[1] < length]
+        self.next_id = next_id
+
+    def changed_on_disk(self):
+        """Cheap check (a few stat calls) for writes by other worker processes."""
+        if snapshot_stat() != self.snapshot or archive.changed_on_disk():
+            return True
+        if STORAGE_BACKEND == "json":
+            return False
+        try:
+            return os.path.getsize(JOURNAL_FILE) != journal.offset
+        except OSError:
+            return journal.offset != 0
+
+    def sync(self):
+        """Pick up records other worker processes wrote. Caller holds write_lock.
+
+        Returns the new (kind, record) pairs, or None if everything had to be
+        reloaded from disk.
+        """
+        changes = []
+        if archive.changed_on_disk():
+            # Another process sealed months, taking their records out of the store.
+            archive.load()
+            self.load()
+            return None
+        if snapshot_stat() != self.snapshot:
+            # Our append handle points at the journal file that was rotated away.
+            journal.close()
+            if STORAGE_BACKEND == "json":
+                self.load()
+                return None
+            # Another worker compacted the journal. Finish reading the journal
+            # generation we were on, then carry on with the new one.
+            if journal.base_seq() > journal.seq:
+                changes = journal.tail(JOURNAL_FILE + ".1")
+                if changes is None or journal.seq != journal.base_seq():
+                    self.load()
+                    return None
+            self.snapshot = snapshot_stat()
+            journal.offset = 0
+            journal.entries = 0
+        elif STORAGE_BACKEND == "json":
+            return []
+        newer = journal.tail()
+        if newer is None:
+            self.load()
+            return None
+        records = [(kind, make_record(kind, record)) for kind, record in changes + newer]
+        changes = []
+        for kind, record in records:
+            if record.get("id") is None:
+                record.id = self.next_id[kind]
+            elif record.id in self.by_id[kind]:
+                continue
+            self._add(kind, record)
+            changes.append((kind, record))
+        return changes
+
+    def append(self, kind, record):
+        """Add and persist a record. Caller holds write_lock."""
+        self.append_many([(kind, record)])
+
+    def append_many(self, entries, durable=False):
+        """Add and persist (kind, record) pairs with a single write, giving each
+        its id. If anything fails, none of them is kept. Caller holds write_lock."""
+        lengths = {kind: len(self.records[kind]) for kind in RECORD_KINDS}
+        next_id = dict(self.next_id)
+        try:
+            for kind, record in entries:
+                record.id = self.next_id[kind]
+                self._add(kind, record)
+            if STORAGE_BACKEND == "json":
+                save_data()
+                return
+            journal.append_many(entries, durable)
+        except BaseException:
+            self._truncate(lengths, next_id)
+            raise
+        if journal.entries >= JOURNAL_COMPACT_EVERY:
+            compact_journal()
+
+    def remove(self, ids):
+        """Drop the records whose ids are in ids ({kind: set of ids}) and write
+        the rest as a fresh snapshot. Caller holds write_lock."""
+        for kind, dropped in ids.items():
+            self.records[kind] = [rec for rec in self.records[kind] if rec.id not in dropped]
+        if STORAGE_BACKEND == "json":
+            save_data()
+        else:
+            compact_journal()
+        self.load()
+
+    def all(self, kind):
+        return self.records[kind]
+
+    def count(self, kind):
+        return len(self.records[kind])
+
+    def last_id(self, kind):
+        """The highest record id of kind, or -1 if there are none."""
+        return self.next_id[kind] - 1
+
+    def get(self, kind, record_id):
+        """Return the record with an id, or None."""
+        position = self.by_id[kind].get(record_id)
+        if position is None:
+            return None
+        return self.records[kind][position]
+
+    def _search(self, kind, query):
+        """Positions of records whose name fields contain query (ignoring case) or whose date contains it."""
+        needle = query.lower()
+        postings = []
+        for field in SEARCH_FIELDS[kind]:
+            postings += self.search_index[(kind, field)].positions(needle)
+        postings += self.search_index[(kind, DATE_FIELDS[kind])].positions(query)
+        if len(postings) == 1:
+            return postings[0]
+        return set().union(*postings)
+
+    def page(self, kind, query="", after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        """One page of records, newest date first, optionally filtered by a search query.
+
+        after/before are keyset cursors: the id of the last record of the
+        previous page (to page towards older records) or of the first record
+        of the next page (to page back towards newer ones). Returns the
+        records, their ids, the total matching count and the cursors for the
+        previous and next pages.
+        """
+        records = self.records[kind]
+        date_field = DATE_FIELDS[kind]
+        keys = self.date_order[kind]
+        if query:
+            keys = sorted((records[position].get(date_field, ""), position) for position in self._search(kind, query))
+        after = self.by_id[kind].get(after)
+        before = self.by_id[kind].get(before)
+
+        # keys ascend, so the newest page is the tail of the list.
+        if after is not None:
+            end = bisect.bisect_left(keys, (records[after].get(date_field, ""), after))
+            start = max(0, end - limit)
+        elif before is not None:
+            start = bisect.bisect_right(keys, (records[before].get(date_field, ""), before))
+            end = min(start + limit, len(keys))
+        else:
+            end = len(keys)
+            start = max(0, end - limit)
+
+        page = [records[position] for _, position in reversed(keys[start:end])]
+        ids = [record.id for record in page]
         return {
-            "sales_records": [],
-            "purchase_records": [],
-            "sale_return_records": [],
-            "purchase_return_records": []
+            "records": page,
+            "ids": ids,
+            "total": len(keys),
+            "prev": ids[0] if ids and end < len(keys) else None,
+            "next": ids[-1] if ids and start > 0 else None
         }
 
-def save_data():
-    """Save the current records to the JSON file."""
-    data = {
-        "sales_records": sales_records,
-        "purchase_records": purchase_records,
-        "sale_return_records": sale_return_records,
-        "purchase_return_records": purchase_return_records
-    }
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
-    app.logger.info("Data saved to %s", DATA_FILE)
+    def export(self, kind, date_from="", date_to="", names=None):
+        """Iterate records in insertion order, limited to an inclusive date range
+        and to records whose fields equal names[field], ignoring case."""
+        records = self.records[kind]
+        if date_from or date_to:
+            keys = self.date_order[kind]
+            lo = bisect.bisect_left(keys, (date_from, -1)) if date_from else 0
+            hi = bisect.bisect_right(keys, (date_to, sys.maxsize)) if date_to else len(keys)
+            positions = sorted(position for _, position in keys[lo:hi])
+        else:
+            positions = range(len(records))
+        wanted = {key_column(field): value.strip().lower() for field, value in (names or {}).items()}
+        for position in positions:
+            record = records[position]
+            if all(getattr(record, key) == value for key, value in wanted.items()):
+                yield record
+
+    def total(self, kind, field):
+        return sum(rec[field] for rec in self.records[kind])
+
+    def values(self, kind, fields):
+        """Iterate tuples of fields (record fields or *_key columns), one per record, in id order."""
+        defaults = [0 if field in NUMERIC_FIELDS else "" for field in fields]
+        for rec in self.records[kind]:
+            yield tuple(getattr(rec, field, default) for field, default in zip(fields, defaults))
+
+    def daily_totals(self, kind):
+        """Sum of kind's money column per (date, product_key), in order of first appearance."""
+        date_field, amount_field = DATE_FIELDS[kind], AMOUNT_FIELDS[kind]
+        totals = {}
+        for rec in self.records[kind]:
+            key = (rec.get(date_field, ""), rec.product_key)
+            totals[key] = totals.get(key, 0) + rec.get(amount_field, 0)
+        return totals
+
+    def totals_by(self, kind, key_field, value_field):
+        """Sum value_field per non-empty key_field, in order of first appearance."""
+        totals = {}
+        for rec in self.records[kind]:
+            key = rec.get(key_field, "")
+            if key:
+                totals[key] = totals.get(key, 0) + rec.get(value_field, 0)
+        return totals
+
+
+class SQLiteStore:
+    """Keeps records in SQLite, one table per record list.
+
+    Product and supplier names are also stored normalized (stripped and
+    lowercased) in indexed *_key columns, so case-insensitive lookups and
+    searches do not need to touch every row in Python. A record's id is its
+    rowid minus one, so ids start at 0 like the JSON store's.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connect()
+        self._create_schema()
+        # Row counts, kept up to date by append() so paging never runs COUNT(*).
+        self._counts = {
+            kind: self.conn.execute(f"SELECT COUNT(*) FROM {kind}").fetchone()[0]
+            for kind in RECORD_KINDS
+        }
+        # Highest rowid seen per table; sync() fetches the rows past it.
+        self._last_rowid = {
+            kind: self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {kind}").fetchone()[0]
+            for kind in RECORD_KINDS
+        }
+        if not any(self.count(kind) for kind in RECORD_KINDS) and newest_snapshot():
+            self._import(load_data())
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def connect(self):
+        """Open this process's connection; called again in forked workers."""
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def changed_on_disk(self):
+        """True once another connection has committed since the last sync()."""
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version
+
+    def sync(self):
+        """Fetch rows other worker processes inserted. Caller holds write_lock."""
+        changes = []
+        with self.lock:
+            self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            for kind in RECORD_KINDS:
+                rows = self.conn.execute(
+                    f"SELECT {self._columns(kind)} FROM {kind} WHERE id > ? ORDER BY id",
+                    (self._last_rowid[kind],)
+                ).fetchall()
+                if rows:
+                    self._counts[kind] += len(rows)
+                    self._last_rowid[kind] = rows[-1]["id"] + 1
+                changes += [(kind, make_record(kind, row)) for row in rows]
+        return changes
+
+    def _create_schema(self):
+        with self.conn:
+            for kind, fields in RECORD_FIELDS.items():
+                columns = ["id INTEGER PRIMARY KEY"]
+                indexed = [DATE_FIELDS[kind]]
+                for field in fields:
+                    if field in NUMERIC_FIELDS:
+                        columns.append(f"{field} REAL NOT NULL DEFAULT 0")
+                    else:
+                        columns.append(f"{field} TEXT NOT NULL DEFAULT ''")
+                    if field.endswith("_name"):
+                        columns.append(f"{key_column(field)} TEXT NOT NULL DEFAULT ''")
+                        indexed += [field, key_column(field)]
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {kind} ({', '.join(columns)})")
+                for column in indexed:
+                    self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{kind}_{column} ON {kind} ({column})")
+
+    def _import(self, data):
+        """Copy records loaded from the snapshot into empty tables."""
+        with self.lock, self.conn:
+            for kind in RECORD_KINDS:
+                assign_ids(data[kind])
+                for record in data[kind]:
+                    self._insert(kind, record)
+                self._counts[kind] += len(data[kind])
+                self._last_rowid[kind] = max((record.id + 1 for record in data[kind]), default=0)
+        app.logger.info("Imported %s into %s", newest_snapshot(), self.path)
+
+    def _insert(self, kind, record):
+        """Insert a record, keeping its id if it has one; returns the rowid."""
+        fields = RECORD_FIELDS[kind]
+        columns = list(fields)
+        values = [record.get(field, 0 if field in NUMERIC_FIELDS else "") for field in fields]
+        for field in fields:
+            if field.endswith("_name"):
+                columns.append(key_column(field))
+                values.append(record.get(field, "").strip().lower())
+        if record.get("id") is not None:
+            columns.append("id")
+            values.append(record.id + 1)
+        placeholders = ", ".join("?" for _ in columns)
+        return self.conn.execute(f"INSERT INTO {kind} ({', '.join(columns)}) VALUES ({placeholders})", values).lastrowid
+
+    @staticmethod
+    def _columns(kind):
+        """The select list that reads a row back as a record."""
+        return f"id - 1 AS id, {', '.join(RECORD_FIELDS[kind])}"
+
+    def _select(self, kind, where="", params=()):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {self._columns(kind)} FROM {kind} {where} ORDER BY id", params).fetchall()
+        return [make_record(kind, row) for row in rows]
+
+    def append(self, kind, record):
+        self.append_many([(kind, record)])
+
+    def append_many(self, entries, durable=False):
+        """Insert (kind, record) pairs in one transaction, synced to disk if
+        durable, and give each the id SQLite assigned it."""
+        with self.lock:
+            if durable:
+                self.conn.execute("PRAGMA synchronous=FULL")
+            try:
+                with self.conn:
+                    rowids = [self._insert(kind, record) for kind, record in entries]
+                for (kind, record), rowid in zip(entries, rowids):
+                    record.id = rowid - 1
+                    self._counts[kind] += 1
+                    self._last_rowid[kind] = max(self._last_rowid[kind], rowid)
+            finally:
+                if durable:
+                    self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def all(self, kind):
+        return self._select(kind)
+
+    def count(self, kind):
+        return self._counts[kind]
+
+    def last_id(self, kind):
+        return self._last_rowid[kind] - 1
+
+    def get(self, kind, record_id):
+        rows = self._select(kind, "WHERE id = ?", (record_id + 1,))
+        return rows[0] if rows else None
+
+    @staticmethod
+    def _search_clause(kind, query):
+        needle = query.lower()
+        conditions = [f"instr({key_column(field)}, ?) > 0" for field in SEARCH_FIELDS[kind]]
+        conditions.append(f"instr({DATE_FIELDS[kind]}, ?) > 0")
+        params = [needle] * len(SEARCH_FIELDS[kind]) + [query]
+        return "(" + " OR ".join(conditions) + ")", params
+
+    def page(self, kind, query="", after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        date_field = DATE_FIELDS[kind]
+        conditions, params = [], []
+        if query:
+            clause, clause_params = self._search_clause(kind, query)
+            conditions.append(clause)
+            params += clause_params
+        with self.lock:
+            if query:
+                total = self.conn.execute(f"SELECT COUNT(*) FROM {kind} WHERE {conditions[0]}", params).fetchone()[0]
+            else:
+                total = self._counts[kind]
+            cursor = after if after is not None else before
+            cursor_row = None
+            if cursor is not None:
+                cursor_row = self.conn.execute(f"SELECT {date_field}, id FROM {kind} WHERE id = ?", (cursor + 1,)).fetchone()
+            # Pages run newest first; paging back towards newer records
+            # reads ascending from the cursor and flips the rows afterwards.
+            backwards = cursor_row is not None and after is None
+            if cursor_row is not None:
+                conditions.append(f"({date_field}, id) {'>' if backwards else '<'} (?, ?)")
+                params += list(cursor_row)
+            where = "WHERE " + " AND ".join(conditions) if conditions else ""
+            direction = "ASC" if backwards else "DESC"
+            rows = self.conn.execute(
+                f"SELECT {self._columns(kind)} FROM {kind} {where} "
+                f"ORDER BY {date_field} {direction}, {kind}.id {direction} LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        records = [make_record(kind, row) for row in rows]
+        ids = [record.id for record in records]
+        has_prev = more if backwards else cursor_row is not None
+        has_next = cursor_row is not None if backwards else more
+        return {
+            "records": records,
+            "ids": ids,
+            "total": total,
+            "prev": ids[0] if ids and has_prev else None,
+            "next": ids[-1] if ids and has_next else None
+        }
+
+    def export(self, kind, date_from="", date_to="", names=None):
+        """Like JsonStore.export, streamed from a private connection so other
+        requests can use self.conn meanwhile."""
+        date_field = DATE_FIELDS[kind]
+        conditions, params = [], []
+        if date_from:
+            conditions.append(f"{date_field} >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append(f"{date_field} <= ?")
+            params.append(date_to)
+        for field, value in (names or {}).items():
+            conditions.append(f"{key_column(field)} = ?")
+            params.append(value.strip().lower())
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(f"SELECT {self._columns(kind)} FROM {kind} {where} ORDER BY id", params)
+            for row in rows:
+                yield make_record(kind, row)
+        finally:
+            conn.close()
+
+    def total(self, kind, field):
+        with self.lock:
+            return self.conn.execute(f"SELECT TOTAL({field}) FROM {kind}").fetchone()[0]
+
+    def values(self, kind, fields):
+        """Like JsonStore.values, streamed from a private connection without building records."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            rows = conn.execute(f"SELECT {', '.join(fields)} FROM {kind} ORDER BY id")
+            while True:
+                chunk = rows.fetchmany(4096)
+                if not chunk:
+                    break
+                yield from chunk
+        finally:
+            conn.close()
+
+    def daily_totals(self, kind):
+        date_field, amount_field = DATE_FIELDS[kind], AMOUNT_FIELDS[kind]
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {date_field}, product_key, TOTAL({amount_field}) FROM {kind} "
+                f"GROUP BY {date_field}, product_key ORDER BY MIN(id)"
+            ).fetchall()
+        return {(date_str, product): amount for date_str, product, amount in rows}
+
+    def totals_by(self, kind, key_field, value_field):
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {key_field}, TOTAL({value_field}) FROM {kind} WHERE {key_field} != '' "
+                f"GROUP BY {key_field} ORDER BY MIN(id)"
+            ).fetchall()
+        return {key: value for key, value in rows}
+
+
+def open_store():
+    """Create the record store selected by STORAGE_BACKEND."""
+    if STORAGE_BACKEND == "sqlite":
+        app.logger.info("Using SQLite storage at %s", SQLITE_FILE)
+        return SQLiteStore(SQLITE_FILE)
+    return JsonStore()
+
+# ---------------- Archive ----------------
+# Sealed months: one read-only segment file each, plus the manifest that
+# holds every segment's summary.
+ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+# How many sealed segments keep their detail rows in memory once read.
+ARCHIVE_CACHE_SEGMENTS = int(os.environ.get("ARCHIVE_CACHE_SEGMENTS", "12"))
+
+
+class ClosedPeriodError(ValueError):
+    """A record dated in a month that has been sealed."""
+
+
+def month_of(record):
+    """YYYY-MM of a record's date, or None if the date does not parse."""
+    parsed = record.parsed_date
+    return f"{parsed.year:04d}-{parsed.month:02d}" if parsed else None
+
+def summarize(kind, records):
+    """Roll records up into one row per date, product and supplier, carrying
+    the summed quantity and money amount, in order of first appearance.
+
+    first_id is the id of the row's first record, so a row also tells when
+    its exact spelling of a name was first seen.
+    """
+    key_fields = (DATE_FIELDS[kind],) + tuple(field for field in RECORD_FIELDS[kind] if field.endswith("_name"))
+    amount_field = AMOUNT_FIELDS[kind]
+    rows = {}
+    for rec in records:
+        key = tuple(rec.get(field, "") for field in key_fields)
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = dict(zip(key_fields, key), quantity=0, first_id=rec.id, **{amount_field: 0})
+        row["first_id"] = min(row["first_id"], rec.id)
+        row["quantity"] += rec.get("quantity", 0)
+        row[amount_field] += rec.get(amount_field, 0)
+    return list(rows.values())
+
+def id_ranges(ids):
+    """Sorted ids as [first, last] runs of consecutive values."""
+    ranges = []
+    for record_id in sorted(ids):
+        if ranges and ranges[-1][1] == record_id - 1:
+            ranges[-1][1] = record_id
+        else:
+            ranges.append([record_id, record_id])
+    return ranges
+
+
+class Archive:
+    """Closed months, sealed out of the live store into read-only segments.
+
+    Each sealed month's records live in ARCHIVE_DIR/<YYYY-MM>.json. The
+    manifest lists, per segment, its checksum, the id ranges it holds and
+    its summary rows (see summarize()), which carry everything profit, cash
+    flow, inventory and supplier balances need. Startup reads only the
+    manifest; a segment's detail rows are read when a report asks for them
+    and the most recently used ARCHIVE_CACHE_SEGMENTS stay in memory.
+    Sealing always covers every month up to sealed_through, and no record
+    dated in a sealed month can be added afterwards.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.json")
+        self.lock = threading.Lock()
+        self.load()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        """(Re)read the manifest."""
+        self.stat = self._stat()
+        manifest = {"sealed_through": "", "segments": {}}
+        if self.stat is not None:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        self.sealed_through = manifest["sealed_through"]
+        self.segments = manifest["segments"]
+        self.months = sorted(self.segments)
+        # Month -> kind -> summary rows as records.
+        self.summary = {
+            month: {kind: [make_record(kind, row) for row in self.segments[month]["summary"][kind]] for kind in RECORD_KINDS}
+            for month in self.months
+        }
+        self.summaries = {kind: [row for month in self.months for row in self.summary[month][kind]] for kind in RECORD_KINDS}
+        # Per kind, sorted (first id, last id, month) runs, for finding a record's segment.
+        self.ranges = {
+            kind: sorted((first, last, month) for month in self.months for first, last in self.segments[month]["ids"][kind])
+            for kind in RECORD_KINDS
+        }
+        self.next_id = {kind: max((last + 1 for _, last, _ in self.ranges[kind]), default=0) for kind in RECORD_KINDS}
+        self._cache = OrderedDict()
+
+    def changed_on_disk(self):
+        return self._stat() != self.stat
+
+    def sealed(self, record):
+        """True if record is dated in a sealed month."""
+        month = month_of(record)
+        return month is not None and month <= self.sealed_through
+
+    def check_open(self, record):
+        """Raise ClosedPeriodError if record is dated in a sealed month."""
+        if self.sealed(record):
+            raise ClosedPeriodError(f"{month_of(record)} is closed; it cannot take new records.")
+
+    def segment(self, month):
+        """{kind: records} of a sealed month, read from its segment file on first use."""
+        with self.lock:
+            records = self._cache.get(month)
+            if records is not None:
+                self._cache.move_to_end(month)
+                return records
+        entry = self.segments[month]
+        with open(os.path.join(self.path, entry["file"]), "rb") as f:
+            payload = f.read()
+        if hashlib.sha256(payload).hexdigest() != entry["sha256"]:
+            raise ValueError(f"Archive segment {entry['file']} does not match its checksum")
+        data = json.loads(payload)
+        records = {kind: [make_record(kind, rec) for rec in data[kind]] for kind in RECORD_KINDS}
+        app.logger.info("Loaded archive segment %s", entry["file"])
+        with self.lock:
+            self._cache[month] = records
+            while len(self._cache) > ARCHIVE_CACHE_SEGMENTS:
+                self._cache.popitem(last=False)
+        return records
+
+    def _month_for(self, kind, record_id):
+        """The sealed month holding the record of kind with an id, or None."""
+        ranges = self.ranges[kind]
+        i = bisect.bisect_right(ranges, (record_id, sys.maxsize)) - 1
+        if i < 0 or ranges[i][1] < record_id:
+            return None
+        return ranges[i][2]
+
+    def holds(self, kind, record):
+        """True if record (by id) is already in a sealed segment."""
+        return self.sealed(record) and self._month_for(kind, record.get("id")) is not None
+
+    def get(self, kind, record_id):
+        """The sealed record of kind with an id, or None."""
+        month = self._month_for(kind, record_id)
+        if month is None:
+            return None
+        for rec in self.segment(month)[kind]:
+            if rec.id == record_id:
+                return rec
+        return None
+
+    def records(self, kind, date_from="", date_to="", names=None):
+        """Iterate sealed records, a month at a time, filtered like store.export().
+
+        Segments whose summary shows no row for names are not read.
+        """
+        wanted = {key_column(field): value.strip().lower() for field, value in (names or {}).items()}
+        date_field = DATE_FIELDS[kind]
+        for month in self.months:
+            if (date_from and month < date_from[:7]) or (date_to and month > date_to[:7]):
+                continue
+            if wanted and not any(all(getattr(row, key) == value for key, value in wanted.items())
+                                  for row in self.summary[month][kind]):
+                continue
+            for rec in self.segment(month)[kind]:
+                date_str = rec.get(date_field, "")
+                if (date_from and date_str < date_from) or (date_to and date_str > date_to):
+                    continue
+                if all(getattr(rec, key) == value for key, value in wanted.items()):
+                    yield rec
+
+    def total(self, kind, field):
+        return sum(row.get(field, 0) for row in self.summaries[kind])
+
+    def seal(self, through, records):
+        """Write segments for the months in records ({month: {kind: [records]}}),
+        all after sealed_through, and mark every month up to through as sealed."""
+        os.makedirs(self.path, exist_ok=True)
+        segments = dict(self.segments)
+        for month in sorted(records):
+            data = {kind: [rec.as_dict() for rec in records[month].get(kind, [])] for kind in RECORD_KINDS}
+            payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+            path = os.path.join(self.path, f"{month}.json")
+            self._write(path, payload)
+            os.chmod(path, 0o444)
+            segments[month] = {
+                "file": f"{month}.json",
+                "sha256": hashlib.sha256(payload).hexdigest(),
+                "counts": {kind: len(data[kind]) for kind in RECORD_KINDS},
+                "ids": {kind: id_ranges(rec["id"] for rec in data[kind]) for kind in RECORD_KINDS},
+                "summary": {kind: summarize(kind, records[month].get(kind, [])) for kind in RECORD_KINDS}
+            }
+        manifest = {"sealed_through": through, "segments": segments}
+        self._write(self.manifest_path, json.dumps(manifest, indent=1).encode("utf-8"))
+        self.load()
+
+    @staticmethod
+    def _write(path, payload):
+        """Write a file through a temporary one renamed into place."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+class LedgerView:
+    """The store with the sealed months in front of its records, as the index rebuilds read it.
+
+    Sealed months appear as their summary rows, which every total is built
+    from.
+    """
+
+    def __init__(self, store, archive):
+        self.store = store
+        self.archive = archive
+        # daily_totals() per kind; several indexes rebuild from the same sums.
+        self._daily_totals = {}
+
+    def all(self, kind):
+        return itertools.chain(self.archive.summaries[kind], self.store.all(kind))
+
+    def total(self, kind, field):
+        return self.archive.total(kind, field) + self.store.total(kind, field)
+
+    def values(self, kind, fields):
+        defaults = [0 if field in NUMERIC_FIELDS else "" for field in fields]
+        sealed = (tuple(getattr(row, field, default) for field, default in zip(fields, defaults))
+                  for row in self.archive.summaries[kind])
+        return itertools.chain(sealed, self.store.values(kind, fields))
+
+    def totals_by(self, kind, key_field, value_field):
+        totals = {}
+        for row in self.archive.summaries[kind]:
+            key = row.get(key_field, "")
+            if key:
+                totals[key] = totals.get(key, 0) + row.get(value_field, 0)
+        for key, value in self.store.totals_by(kind, key_field, value_field).items():
+            totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def daily_totals(self, kind):
+        if kind in self._daily_totals:
+            return self._daily_totals[kind]
+        date_field, amount_field = DATE_FIELDS[kind], AMOUNT_FIELDS[kind]
+        totals = self._daily_totals[kind] = {}
+        for row in self.archive.summaries[kind]:
+            key = (row.get(date_field, ""), row.product_key)
+            totals[key] = totals.get(key, 0) + row.get(amount_field, 0)
+        for key, value in self.store.daily_totals(kind).items():
+            totals[key] = totals.get(key, 0) + value
+        return totals
+
+# ---------------- Aggregates ----------------
+# When set, /profit and /cash-flow compare the running totals against a full
+# recomputation on every request and log (and repair) any difference.
+VERIFY_AGGREGATES = os.environ.get("VERIFY_AGGREGATES", "") not in ("", "0")
+
+
+class RunningTotals:
+    """Running sum of the money column of each record list.
+
+    Rebuilt from the store once at startup and bumped by add_record(), so
+    /profit and /cash-flow no longer re-sum every record on each request.
+    """
+
+    def __init__(self):
+        self.amounts = dict.fromkeys(RECORD_KINDS, 0)
+
+    @staticmethod
+    def recompute(store):
+        return {kind: store.total(kind, AMOUNT_FIELDS[kind]) for kind in RECORD_KINDS}
+
+    def rebuild(self, store):
+        self.amounts = self.recompute(store)
+
+    def add(self, kind, record):
+        self.amounts[kind] += record[AMOUNT_FIELDS[kind]]
+
+    def __getitem__(self, kind):
+        return self.amounts[kind]
+
+    def verify(self, store):
+        """Check the running totals against a full recomputation; return True if they agree."""
+        expected = self.recompute(store)
+        if expected == self.amounts:
+            return True
+        app.logger.error("Running totals drifted: have %s, expected %s", self.amounts, expected)
+        self.amounts = expected
+        return False
+
+
+# ---------------- Inventory Index ----------------
+class FirstSeenOrder:
+    """Listing order of grouped keys, kept incrementally.
+
+    Reproduces the order a from-scratch scan produces when it walks the
+    record lists one after another: keys first seen in the first list come
+    first, then keys first seen in the second list, and so on, each in
+    order of first appearance. Callers that know where a key appeared
+    (a record id) pass it as position and may see keys in any order.
+    """
+
+    def __init__(self, kinds):
+        self.rank_for = {kind: rank for rank, kind in enumerate(kinds)}
+        self.seen = {kind: set() for kind in kinds}
+        self.keys = {}
+
+    def see(self, kind, key, position=None):
+        """Record that key appeared in kind; return True if the listing order changed."""
+        seen = self.seen[kind]
+        if position is None:
+            if key in seen:
+                return False
+            position = len(seen)
+        rank = (self.rank_for[kind], position)
+        seen.add(key)
+        if key in self.keys and self.keys[key] <= rank:
+            return False
+        self.keys[key] = rank
+        return True
+
+    def sorted(self, keys):
+        return sorted(keys, key=self.keys.__getitem__)
+
+
+class InventoryIndex:
+    """Per-product stock counters, updated on every write.
+
+    Products are keyed by their exact name, as on the /inventory page. Each
+    entry carries the four movement totals plus current_inventory, and the
+    full table keeps the product order of the original full scan.
+
+    Writers and readers share lock: a product's entry is complete before it
+    is published, and all() hands out a table that is never changed in
+    place afterwards (only the counters inside it move).
+    """
+
+    # Which counter each record list moves, in listing order.
+    COLUMNS = (
+        ("purchase_records", "purchased"),
+        ("purchase_return_records", "purchase_returns"),
+        ("sales_records", "sold"),
+        ("sale_return_records", "sales_returns")
+    )
+    COLUMN_FOR = dict(COLUMNS)
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.products = {}
+        self._order = FirstSeenOrder(self.COLUMN_FOR)
+        self._listing = None
+
+    def rebuild(self, store):
+        with self.lock:
+            self._reset()
+            for kind, _ in self.COLUMNS:
+                for product, quantity in store.totals_by(kind, "product_name", "quantity").items():
+                    self._bump(kind, product, quantity)
+
+    def add(self, kind, record):
+        product = record.get("product_name", "")
+        if product:
+            self._bump(kind, product, record.get("quantity", 0))
+
+    def _bump(self, kind, product, quantity):
+        with self.lock:
+            data = self.products.get(product)
+            if data is None:
+                data = {"purchased": 0, "purchase_returns": 0, "sold": 0, "sales_returns": 0, "current_inventory": 0}
+                self.products[product] = data
+            data[self.COLUMN_FOR[kind]] += quantity
+            data["current_inventory"] = data["purchased"] - data["purchase_returns"] - data["sold"] + data["sales_returns"]
+            if self._order.see(kind, product):
+                self._listing = None
+
+    def all(self):
+        """The full inventory table; re-sorted only when a product first appears in a record list."""
+        with self.lock:
+            if self._listing is None:
+                self._listing = {product: self.products[product] for product in self._order.sorted(self.products)}
+            return self._listing
+
+    def get(self, product):
+        """Counters for one product, or None if it has never moved."""
+        return self.products.get(product)
+
+    def low_stock(self, threshold):
+        """Products whose current inventory is at or below threshold."""
+        return {product: data for product, data in self.all().items()
+                if data["current_inventory"] <= threshold}
+
+
+# ---------------- Supplier Ledger Index ----------------
+class SupplierLedgerIndex:
+    """Purchases and purchase returns grouped by supplier, updated on every write.
+
+    Suppliers are keyed by normalized name (stripped and lowercased) and
+    listed under the first spelling seen. Each entry holds the supplier's
+    records, running totals, and the transaction rows used by the ledger
+    PDFs, kept sorted by date (purchases before returns on the same day,
+    then by record id; unparseable dates last).
+
+    Sealed months come in as summary rows, which count towards the totals
+    only; summarized is then True, and detail() and ledger(detail=True)
+    read the sealed records a report needs from the archive segments for
+    that one call. Summary rows carry the id of their first record, so
+    suppliers keep the listing order and spelling their records gave them
+    before sealing.
+
+    Like InventoryIndex, writers and readers share lock, and ledger()
+    returns a listing that is replaced rather than changed.
+
+    A lazy index (the SQLite backend) keeps only each supplier's totals,
+    built from the store's per-name sums; detail() and ledger(detail=True)
+    read the records from the store when a report lists them, so they are
+    never all held in memory.
+    """
+
+    KINDS = ("purchase_records", "purchase_return_records")
+
+    def __init__(self, lazy=False):
+        self.lazy = lazy
+        self.store = None
+        self.archive = None
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.suppliers = {}
+        # Normalized name -> sort keys parallel to the entry's transactions.
+        self._sort_keys = {}
+        self._order = FirstSeenOrder(self.KINDS)
+        self._listing = None
+        self.summarized = False
+
+    def rebuild(self, store, archive=None):
+        """Index store's records, after the summary rows of archive's sealed months if given."""
+        with self.lock:
+            self._reset()
+            self.store = store
+            self.archive = archive
+            for kind in self.KINDS:
+                for row in archive.summaries[kind] if archive is not None else ():
+                    if self._entry(kind, row, row.get("first_id")) is not None:
+                        self.summarized = True
+                if self.lazy:
+                    amount_field = AMOUNT_FIELDS[kind]
+                    for name, amount in store.totals_by(kind, "supplier_name", amount_field).items():
+                        self._entry(kind, make_record(kind, {"supplier_name": name, amount_field: amount}))
+                    continue
+                for rec in store.all(kind):
+                    self._add(kind, rec)
+
+    def _entry(self, kind, record, position=None):
+        """The entry of record's supplier, created on first sight, with record
+        added to its totals; None if record names no supplier.
+
+        position is where record stands among its kind (its id); the entry
+        takes the spelling of the supplier's earliest record.
+        """
+        name = record.get("supplier_name", "").strip()
+        if not name:
+            return None
+        key = record.supplier_key
+        data = self.suppliers.get(key)
+        if data is None:
+            data = self.suppliers[key] = {
+                "name": name,
+                "purchases": [],
+                "purchase_returns": [],
+                "total_purchase": 0,
+                "total_return": 0,
+                "net": 0,
+                "transactions": []
+            }
+            self._sort_keys[key] = []
+        if kind == "purchase_records":
+            data["total_purchase"] += record["total_purchase"]
+        else:
+            data["total_return"] += record["total_return"]
+        data["net"] = data["total_purchase"] - data["total_return"]
+        if self._order.see(kind, key, position):
+            data["name"] = name
+            self._listing = None
+        return data
+
+    def add(self, kind, record):
+        if kind not in self.KINDS:
+            return
+        with self.lock:
+            if self.lazy:
+                self._entry(kind, record)
+            else:
+                self._add(kind, record)
+
+    def _add(self, kind, record):
+        data = self._entry(kind, record, record.id)
+        if data is None:
+            return
+
+        if kind == "purchase_records":
+            data["purchases"].insert(bisect.bisect(data["purchases"], record.id, key=lambda rec: rec.id), record)
+            transaction = {
+                "id": record.id,
+                "date": record.get("purchase_date", ""),
+                "product": record.get("product_name", ""),
+                "quantity": record.get("quantity", 0),
+                "balance": record.get("total_purchase", 0)
+            }
+        else:
+            data["purchase_returns"].insert(bisect.bisect(data["purchase_returns"], record.id, key=lambda rec: rec.id), record)
+            transaction = {
+                "id": record.id,
+                "date": record.get("return_date", ""),
+                "product": record.get("product_name", ""),
+                "quantity": record.get("quantity", 0),
+                "balance": record.get("total_return", 0),
+                "credit": record.get("total_return", 0)
+            }
+
+        day = record.parsed_date.toordinal() if record.parsed_date else sys.maxsize
+        sort_key = (day, self.KINDS.index(kind), record.id)
+        sort_keys = self._sort_keys[record.supplier_key]
+        position = bisect.bisect(sort_keys, sort_key)
+        sort_keys.insert(position, sort_key)
+        data["transactions"].insert(position, transaction)
+
+    def _read(self, supplier=None):
+        """A full index of one supplier's records (every supplier's if None),
+        read afresh from the store and the sealed segments, for one report."""
+        with self.lock:
+            store, archive = self.store, self.archive if self.summarized else None
+        names = None if supplier is None else {"supplier_name": supplier}
+        full = SupplierLedgerIndex()
+        for kind in self.KINDS:
+            if archive is not None:
+                for rec in archive.records(kind, names=names):
+                    full._add(kind, rec)
+            for rec in store.all(kind) if names is None else store.export(kind, names=names):
+                full._add(kind, rec)
+        return full
+
+    def ledger(self, detail=False):
+        """All suppliers, keyed by display name, in the original listing order.
+
+        With detail, a lazy or summarized index reads every entry's records
+        afresh; the result is not kept.
+        """
+        if detail and (self.lazy or self.summarized):
+            return self._read().ledger()
+        with self.lock:
+            if self._listing is None:
+                self._listing = {self.suppliers[key]["name"]: self.suppliers[key]
+                                 for key in self._order.sorted(self.suppliers)}
+            return self._listing
+
+    def get(self, supplier):
+        """One supplier's ledger entry by name (any case), or None.
+
+        A lazy index's entries carry the totals but not the records.
+        """
+        return self.suppliers.get(supplier.strip().lower())
+
+    def detail(self, supplier):
+        """Like get(), but with the supplier's records and transactions even
+        in a lazy or summarized index; only segments naming the supplier are read."""
+        if not (self.lazy or self.summarized):
+            return self.get(supplier)
+        return self._read(supplier).get(supplier)
+
+
+# ---------------- Sale Return Index ----------------
+class SaleReturnIndex:
+    """Sale returns grouped by normalized product name, for the invoices.
+
+    Each product's returns are kept sorted by their parsed return date, so
+    the returns on or after a sale date are a bisect away. Returns with
+    unparseable dates never match a sale and are left out.
+
+    A lazy index (the SQLite backend) holds nothing and looks up a
+    product's returns in the store instead.
+    """
+
+    def __init__(self, lazy=False):
+        self.lazy = lazy
+        self.store = None
+        # Normalized name -> sorted (return date, record id, record).
+        self.products = {}
+
+    def rebuild(self, store):
+        self.store = store
+        self.products = {}
+        if self.lazy:
+            return
+        for rec in store.all("sale_return_records"):
+            self.add("sale_return_records", rec)
+
+    def add(self, kind, record):
+        if kind != "sale_return_records" or self.lazy:
+            return
+        if record.parsed_date is None:
+            return
+        bisect.insort(self.products.setdefault(record.product_key, []), (record.parsed_date, record.id, record))
+
+    def since(self, product, date):
+        """Returns of product dated on or after date, in the order they were recorded."""
+        if self.lazy:
+            return [rec for rec in self.store.export("sale_return_records", names={"product_name": product})
+                    if rec.parsed_date is not None and rec.parsed_date >= date]
+        entries = self.products.get(product.strip().lower(), [])
+        start = bisect.bisect_left(entries, (date,))
+        return [record for _, _, record in sorted(entries[start:], key=lambda entry: entry[1])]
+
+
+# ---------------- Cash Flow Rollups ----------------
+class CashFlowRollup:
+    """Cash movements bucketed by day, ISO week and month, updated on every write.
+
+    Each bucket keeps a running sum per record list; inflow (sales less sale
+    returns) and outflow (purchases less purchase returns) are derived when a
+    report reads the buckets. Dates that do not parse as YYYY-MM-DD only get
+    a daily bucket, as in the original report.
+
+    add() and report() share lock, so a report never walks buckets that a
+    writer is adding to.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.days = {}
+        self.weeks = {}
+        self.months = {}
+        # Day keys in sorted order, for date-range lookups.
+        self._dates = []
+        # Day key -> ((iso_year, iso_week), "YYYY-MM"), or None if unparseable.
+        self._periods = {}
+
+    def rebuild(self, store):
+        """Fill the buckets from the store's per-day totals, not its records."""
+        with self.lock:
+            self._reset()
+            for kind in RECORD_KINDS:
+                for (date_str, _), amount in store.daily_totals(kind).items():
+                    self._add(kind, date_str, amount)
+
+    def add(self, kind, record):
+        self._add(kind, record.get(DATE_FIELDS[kind], ""), record.get(AMOUNT_FIELDS[kind], 0))
+
+    def _add(self, kind, date_str, amount):
+        if not date_str:
+            return
+        with self.lock:
+            if date_str not in self.days:
+                self.days[date_str] = dict.fromkeys(RECORD_KINDS, 0)
+                bisect.insort(self._dates, date_str)
+                parsed_date = parse_date(date_str)
+                if parsed_date is not None:
+                    iso_year, iso_week, _ = parsed_date.isocalendar()
+                    self._periods[date_str] = ((iso_year, iso_week), date_str[:7])
+                else:
+                    self._periods[date_str] = None
+            self.days[date_str][kind] += amount
+            if self._periods[date_str]:
+                week, month = self._periods[date_str]
+                for buckets, key in ((self.weeks, week), (self.months, month)):
+                    if key not in buckets:
+                        buckets[key] = dict.fromkeys(RECORD_KINDS, 0)
+                    buckets[key][kind] += amount
+
+    @staticmethod
+    def _flow(sums):
+        inflow = sums["sales_records"] - sums["sale_return_records"]
+        outflow = sums["purchase_records"] - sums["purchase_return_records"]
+        return {"inflow": inflow, "outflow": outflow, "net": inflow - outflow}
+
+    def report(self, date_from="", date_to=""):
+        """Daily, weekly and monthly rows, optionally limited to an inclusive date range.
+
+        With a range only the day buckets inside it are read; weeks and months
+        at the edges of the range cover just the days that fall inside it.
+        """
+        with self.lock:
+            return self._report(date_from, date_to)
+
+    def _report(self, date_from, date_to):
+        lo = bisect.bisect_left(self._dates, date_from) if date_from else 0
+        hi = bisect.bisect_right(self._dates, date_to) if date_to else len(self._dates)
+        dates = self._dates[lo:hi]
+
+        if date_from or date_to:
+            weeks, months = {}, {}
+            for date_str in dates:
+                if not self._periods[date_str]:
+                    continue
+                week, month = self._periods[date_str]
+                for buckets, key in ((weeks, week), (months, month)):
+                    if key not in buckets:
+                        buckets[key] = dict.fromkeys(RECORD_KINDS, 0)
+                    for kind, amount in self.days[date_str].items():
+                        buckets[key][kind] += amount
+        else:
+            weeks, months = self.weeks, self.months
+
+        daily_flow = [dict(date=date_str, **self._flow(self.days[date_str])) for date_str in dates]
+        weekly_flow = [dict(week=f"{year}-W{week}", **self._flow(weeks[(year, week)]))
+                       for year, week in sorted(weeks)]
+        monthly_flow = [dict(month=month, **self._flow(months[month])) for month in sorted(months)]
+        return daily_flow, weekly_flow, monthly_flow
+
+
+# ---------------- Period Totals ----------------
+class PrefixSums:
+    """Amounts bucketed by day, with running totals over the sorted days.
+
+    The sum over any date range is the difference of two running totals
+    found by bisection. A record dated after every bucket seen so far
+    (the usual case) updates one running total; a back-dated one updates
+    the totals of the days after it.
+    """
+
+    def __init__(self):
+        self.days = []
+        self.cumulative = []
+        # Amounts of records whose date does not parse; counted only without a range.
+        self.undated = 0
+
+    def add(self, day, amount):
+        if day is None:
+            self.undated += amount
+            return
+        days, cumulative = self.days, self.cumulative
+        i = bisect.bisect_left(days, day)
+        if i == len(days) or days[i] != day:
+            # Running total first, so a reader never bisects to a day without one.
+            cumulative.insert(i, cumulative[i - 1] if i else 0)
+            days.insert(i, day)
+        for j in range(i, len(cumulative)):
+            cumulative[j] += amount
+
+    def total(self, start=None, end=None):
+        """Sum over days start..end inclusive (ordinals; None for an open end)."""
+        if start is None and end is None:
+            return (self.cumulative[-1] if self.cumulative else 0) + self.undated
+        lo = bisect.bisect_left(self.days, start) if start is not None else 0
+        hi = bisect.bisect_right(self.days, end) if end is not None else len(self.days)
+        if hi <= lo:
+            return 0
+        return self.cumulative[hi - 1] - (self.cumulative[lo - 1] if lo else 0)
+
+
+class PeriodTotals:
+    """Money totals of each record list over any date range, overall or per product.
+
+    Backs the from/to and product filters of /profit and /cash-flow.
+    Products are matched by normalized name.
+    """
+
+    def __init__(self):
+        # (kind, product_key or None) -> PrefixSums
+        self.series = {}
+
+    def rebuild(self, store):
+        """Fill the series from the store's per-day totals, not its records."""
+        self.__init__()
+        for kind in RECORD_KINDS:
+            for (date_str, product), amount in store.daily_totals(kind).items():
+                self._add(kind, parse_date(date_str), product, amount)
+
+    def add(self, kind, record):
+        self._add(kind, record.parsed_date, record.product_key, record.get(AMOUNT_FIELDS[kind], 0))
+
+    def _add(self, kind, parsed_date, product_key, amount):
+        day = parsed_date.toordinal() if parsed_date else None
+        for product in (None, product_key) if product_key else (None,):
+            series = self.series.get((kind, product))
+            if series is None:
+                series = self.series[(kind, product)] = PrefixSums()
+            series.add(day, amount)
+
+    def total(self, kind, date_from="", date_to="", product=""):
+        """Total of kind dated within an inclusive YYYY-MM-DD range, optionally for one product."""
+        series = self.series.get((kind, product.strip().lower() or None))
+        if series is None:
+            return 0
+        return series.total(parse_date(date_from).toordinal() if date_from else None,
+                            parse_date(date_to).toordinal() if date_to else None)
+
+
+# ---------------- Analytics ----------------
+# "numpy" answers /analytics from column arrays when numpy is installed;
+# "python" (or a missing numpy) scans the store instead. Both give the same numbers.
+ANALYTICS_ENGINE = os.environ.get("ANALYTICS_ENGINE", "numpy")
+ANALYTICS_GROUPS = ("product", "supplier", "day", "month")
+
+
+class ColumnarAnalytics:
+    """Every record list as numpy columns, for vectorized totals and group-bys.
+
+    Columns per record type: amount, quantity, date ordinal and month
+    number (-1 when the date does not parse), product id (exact name, as
+    on /inventory) and supplier id (normalized, as in the supplier
+    ledger; -1 when there is none). Rebuilt at startup from store.values(),
+    a few thousand rows at a time, and appended to on every write; arrays
+    grow by doubling.
+
+    Sums use cumsum and bincount, which add values one after another in
+    record order exactly like the Python loops of the other handlers, so
+    the results agree to the last bit.
+    """
+
+    COLUMNS = (("amount", "float64"), ("quantity", "float64"), ("day", "int64"),
+               ("month", "int64"), ("product", "int64"), ("supplier", "int64"))
+
+    def __init__(self):
+        self.columns = {kind: self._allocate(1024) for kind in RECORD_KINDS}
+        self.sizes = dict.fromkeys(RECORD_KINDS, 0)
+        # Name -> id, and id -> name, for products and suppliers.
+        self.product_ids, self.product_names = {}, []
+        self.supplier_ids, self.supplier_keys = {}, []
+
+    def _allocate(self, capacity):
+        return {name: numpy.zeros(capacity, dtype) for name, dtype in self.COLUMNS}
+
+    def rebuild(self, store):
+        self.__init__()
+        for kind in RECORD_KINDS:
+            fields = (AMOUNT_FIELDS[kind], "quantity", DATE_FIELDS[kind], "product_name")
+            if "supplier_name" in RECORD_FIELDS[kind]:
+                fields += ("supplier_key",)
+            rows = iter(store.values(kind, fields))
+            while True:
+                chunk = list(itertools.islice(rows, 4096))
+                if not chunk:
+                    break
+                self._extend(kind, *zip(*chunk))
+
+    def add(self, kind, record):
+        self._extend(kind, [record.get(AMOUNT_FIELDS[kind], 0)], [record.get("quantity", 0)],
+                     [record.get(DATE_FIELDS[kind], "")], [record.get("product_name", "")],
+                     [getattr(record, "supplier_key", "")])
+
+    def _extend(self, kind, amounts, quantities, dates, products, suppliers=None):
+        """Append rows given as parallel sequences of column values."""
+        columns = self.columns[kind]
+        n = self.sizes[kind]
+        end = n + len(amounts)
+        if end > len(columns["amount"]):
+            capacity = len(columns["amount"])
+            while capacity < end:
+                capacity *= 2
+            grown = self._allocate(capacity)
+            for name, column in columns.items():
+                grown[name][:n] = column[:n]
+            # Swapped in whole, so readers never see columns of mixed lengths.
+            self.columns[kind] = columns = grown
+        parsed = [parse_date(date_str) for date_str in dates]
+        columns["amount"][n:end] = amounts
+        columns["quantity"][n:end] = quantities
+        columns["day"][n:end] = [day.toordinal() if day else -1 for day in parsed]
+        columns["month"][n:end] = [day.year * 12 + day.month - 1 if day else -1 for day in parsed]
+        columns["product"][n:end] = [self._id(self.product_ids, self.product_names, name) for name in products]
+        columns["supplier"][n:end] = ([self._id(self.supplier_ids, self.supplier_keys, key) for key in suppliers]
+                                      if suppliers is not None else -1)
+        self.sizes[kind] = end
+
+    @staticmethod
+    def _id(ids, names, name):
+        if not name:
+            return -1
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def sums(self, group=None, date_from="", date_to=""):
+        """{group key: {kind: (amount, quantity)}} over records dated within an inclusive range.
+
+        With no group everything lands under the key None. Records whose
+        date does not parse only count when there is no range and no
+        date grouping.
+        """
+        result = {}
+        for kind in RECORD_KINDS:
+            columns = self.columns[kind]
+            n = min(self.sizes[kind], len(columns["amount"]))
+            amount, quantity = columns["amount"][:n], columns["quantity"][:n]
+            mask = None
+            if date_from or date_to or group in ("day", "month"):
+                day = columns["day"][:n]
+                mask = day >= (parse_date(date_from).toordinal() if date_from else 0)
+                if date_to:
+                    mask &= day <= parse_date(date_to).toordinal()
+            if group is None:
+                if mask is not None:
+                    amount, quantity = amount[mask], quantity[mask]
+                result.setdefault(None, {})[kind] = (self._sum(amount), self._sum(quantity))
+                continue
+            ids = columns[group][:n]
+            keep = ids >= 0 if mask is None else mask & (ids >= 0)
+            ids, amount, quantity = ids[keep], amount[keep], quantity[keep]
+            if not len(ids):
+                continue
+            present = numpy.unique(ids)
+            amounts = numpy.bincount(ids, weights=amount)
+            quantities = numpy.bincount(ids, weights=quantity)
+            for group_id in present.tolist():
+                key = self._label(group, group_id)
+                result.setdefault(key, {})[kind] = (float(amounts[group_id]), float(quantities[group_id]))
+        return result
+
+    @staticmethod
+    def _sum(values):
+        return float(numpy.cumsum(values)[-1]) if len(values) else 0.0
+
+    def _label(self, group, group_id):
+        if group == "product":
+            return self.product_names[group_id]
+        if group == "supplier":
+            return self.supplier_keys[group_id]
+        if group == "day":
+            return datetime.fromordinal(group_id).strftime("%Y-%m-%d")
+        return f"{group_id // 12:04d}-{group_id % 12 + 1:02d}"
+
+
+def scan_sums(group=None, date_from="", date_to=""):
+    """ColumnarAnalytics.sums computed by walking the store record by record."""
+    start = parse_date(date_from) if date_from else None
+    end = parse_date(date_to) if date_to else None
+    result = {}
+    ledger = LedgerView(store, archive)
+    for kind in RECORD_KINDS:
+        for rec in ledger.all(kind):
+            parsed = rec.parsed_date
+            if start or end or group in ("day", "month"):
+                if parsed is None or (start and parsed < start) or (end and parsed > end):
+                    continue
+            if group is None:
+                key = None
+            elif group == "product":
+                key = rec.get("product_name", "")
+            elif group == "supplier":
+                key = getattr(rec, "supplier_key", "")
+            elif group == "day":
+                key = parsed.strftime("%Y-%m-%d")
+            else:
+                key = parsed.strftime("%Y-%m")
+            if group is not None and not key:
+                continue
+            sums = result.setdefault(key, {})
+            amount, quantity = sums.get(kind, (0.0, 0.0))
+            sums[kind] = (amount + rec.get(AMOUNT_FIELDS[kind], 0), quantity + rec.get("quantity", 0))
+        if group is None:
+            result.setdefault(None, {}).setdefault(kind, (0.0, 0.0))
+    return result
+
+def analytics_rows(group=None, date_from="", date_to=""):
+    """Profit and stock figures per group (or overall), from the columnar engine if enabled."""
+    sums = analytics.sums(group, date_from, date_to) if analytics is not None else scan_sums(group, date_from, date_to)
+    rows = []
+    for key in sorted(sums, key=lambda key: "" if key is None else key):
+        by_kind = sums[key]
+        amount = {kind: by_kind.get(kind, (0.0, 0.0))[0] for kind in RECORD_KINDS}
+        quantity = {kind: by_kind.get(kind, (0.0, 0.0))[1] for kind in RECORD_KINDS}
+        row = {} if group is None else {group: supplier_index.get(key)["name"] if group == "supplier" else key}
+        net_sales = amount["sales_records"] - amount["sale_return_records"]
+        net_purchases = amount["purchase_records"] - amount["purchase_return_records"]
+        row.update({
+            "total_sales": amount["sales_records"],
+            "total_sale_returns": amount["sale_return_records"],
+            "net_sales": net_sales,
+            "total_purchases": amount["purchase_records"],
+            "total_purchase_returns": amount["purchase_return_records"],
+            "net_purchases": net_purchases,
+            "gross_profit": net_sales - net_purchases
+        })
+        for kind, column in InventoryIndex.COLUMNS:
+            row[column] = quantity[kind]
+        row["current_inventory"] = row["purchased"] - row["purchase_returns"] - row["sold"] + row["sales_returns"]
+        rows.append(row)
+    return rows
+
+
+# ---------------- Render Caches ----------------
+# Bump whenever the layout code of a PDF changes, so older renders stop matching.
+PDF_TEMPLATE_VERSION = 1
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PDF_CACHE_MAX_AGE = float(os.environ.get("PDF_CACHE_MAX_AGE", "3600"))
+# PDFs are built in memory; past this size they spill into a private temp file.
+PDF_SPOOL_BYTES = int(os.environ.get("PDF_SPOOL_BYTES", str(8 * 1024 * 1024)))
+# Rendered report pages kept per route, query and data version; 0 disables.
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_AGE = float(os.environ.get("RESPONSE_CACHE_MAX_AGE", "3600"))
+
+
+class RenderCache:
+    """Rendered PDF or page bytes, keyed by a hash of everything that went into them.
+
+    Because the key covers the input records (or the data version) and
+    PDF_TEMPLATE_VERSION, a hit is always byte-for-byte what a fresh render
+    would produce. Entries are
+    also tagged (e.g. by supplier or product) so writes can drop the renders
+    they make stale right away instead of waiting for them to be evicted.
+    Eviction is least-recently-used once the cache exceeds max_bytes, and
+    any entry older than max_age seconds is discarded.
+    """
+
+    def __init__(self, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = 0
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, inputs):
+        payload = json.dumps([PDF_TEMPLATE_VERSION, name, inputs], sort_keys=True, default=json_default)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            data, created, _ = entry
+            if time.monotonic() - created > self.max_age:
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data, tags=()):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            if len(data) > self.max_bytes:
+                return
+            self.entries[key] = (data, time.monotonic(), tuple(tags))
+            self.size += len(data)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def invalidate(self, tag):
+        """Drop every render carrying tag."""
+        with self.lock:
+            for key in list(self.tags.get(tag, ())):
+                self._drop(key)
+
+    def _drop(self, key):
+        data, _, tags = self.entries.pop(key)
+        self.size -= len(data)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+
+pdf_cache = RenderCache(PDF_CACHE_MAX_BYTES, PDF_CACHE_MAX_AGE)
+response_cache = RenderCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_AGE)
+
+def invalidate_pdfs(kind, record):
+    """Drop cached PDFs that a new record makes stale."""
+    if kind == "sale_return_records":
+        # Invoices list the returns of their product.
+        pdf_cache.invalidate(("product", record.product_key))
+    elif kind in ("purchase_records", "purchase_return_records"):
+        pdf_cache.invalidate(("supplier", record.supplier_key))
+        pdf_cache.invalidate(("suppliers",))
+
+def cached_pdf(name, inputs, tags, render, filename):
+    """Send the PDF for inputs from pdf_cache, calling render(output) to build it on a miss.
+
+    PDFs are rendered into a per-request buffer, never a shared path on disk.
+    A render larger than PDF_SPOOL_BYTES spills into a private temporary
+    file and is streamed from there without being cached.
+    """
+    key = pdf_cache.key(name, inputs)
+    data = pdf_cache.get(key)
+    if data is not None:
+        app.logger.info("Serving %s from the PDF cache", filename)
+    else:
+        output = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+        with timed("pdf"):
+            render(output)
+        if output.tell() > PDF_SPOOL_BYTES:
+            output.seek(0)
+            return send_file(output, mimetype="application/pdf", as_attachment=True, download_name=filename)
+        output.seek(0)
+        data = output.read()
+        output.close()
+        pdf_cache.put(key, data, tags)
+    return send_file(io.BytesIO(data), mimetype="application/pdf", as_attachment=True, download_name=filename)
+
+
+# ---------------- Conditional Responses ----------------
+def release_token():
+    """Short hash of this module and its templates; changes with every release
+    but is the same in every worker process running one."""
+    digest = hashlib.sha256()
+    paths = [os.path.abspath(__file__)]
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        paths += sorted(os.path.join(root, name) for name in files)
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+# Part of every ETag, so a deploy invalidates what clients hold; set it to
+# pin the token to a build id instead of the source hash.
+RELEASE_TOKEN = os.environ.get("RELEASE_TOKEN") or release_token()
+
+
+class DataVersion:
+    """Version of the records as a whole, behind the report routes' ETags.
+
+    The version counts every record ever written (the next free id of each
+    record list) and names the last sealed month, so each write moves it on
+    and every worker process agrees on it once it has synced. The ETag also
+    names PDF_TEMPLATE_VERSION and RELEASE_TOKEN, so new layouts are never
+    answered with a 304. changed is when this process first saw the current
+    version (the Last-Modified).
+    """
+
+    def __init__(self):
+        self.value = None
+        self.changed = None
+        self.lock = threading.Lock()
+
+    def bump(self):
+        """Take up the version after records were written, reloaded or sealed."""
+        written = sum(store.last_id(kind) + 1 for kind in RECORD_KINDS)
+        value = f"{PDF_TEMPLATE_VERSION}-{RELEASE_TOKEN}-{written}-{archive.sealed_through or 'open'}"
+        with self.lock:
+            if value != self.value:
+                self.value = value
+                self.changed = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def validators(self):
+        """(etag, last_modified) of the current version."""
+        with self.lock:
+            return self.value, self.changed
+
+
+data_version = DataVersion()
+
+def conditional_report(view):
+    """Answer GETs of a report route from the data version.
+
+    Responses carry the version as ETag and Last-Modified, with
+    Cache-Control: no-cache so clients revalidate on every poll. A request
+    whose validators still match gets a 304 without the report being
+    computed, and HTML pages are kept in response_cache under the route,
+    its arguments and the version, so terminals polling one page share a
+    single render per change. If-None-Match wins over If-Modified-Since,
+    whose one-second resolution can miss a second write within a second.
+    """
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return view(**kwargs)
+        etag, last_modified = data_version.validators()
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = app.response_class(status=304)
+        else:
+            key = response_cache.key(request.endpoint, [kwargs, sorted(request.args.items(multi=True)), etag])
+            body = response_cache.get(key)
+            if body is not None:
+                app.logger.info("Serving %s from the response cache", request.full_path)
+                response = app.response_class(body, mimetype="text/html")
+            else:
+                response = app.make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                if response.mimetype == "text/html" and not response.direct_passthrough:
+                    response_cache.put(key, response.get_data())
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+
+def index_record(kind, record):
+    """Fold a record that is already in the store into the in-memory indexes."""
+    totals.add(kind, record)
+    inventory_index.add(kind, record)
+    cash_flow_rollup.add(kind, record)
+    period_totals.add(kind, record)
+    if analytics is not None:
+        analytics.add(kind, record)
+    supplier_index.add(kind, record)
+    sale_return_index.add(kind, record)
+    invalidate_pdfs(kind, record)
+
+def rebuild_indexes():
+    """Rebuild every in-memory index from the store and the sealed months' summaries."""
+    ledger = LedgerView(store, archive)
+    totals.rebuild(ledger)
+    inventory_index.rebuild(ledger)
+    cash_flow_rollup.rebuild(ledger)
+    period_totals.rebuild(ledger)
+    if analytics is not None:
+        analytics.rebuild(ledger)
+    supplier_index.rebuild(store, archive)
+    sale_return_index.rebuild(store)
+    data_version.bump()
+
+def apply_sync():
+    """Apply records other worker processes wrote. Caller holds write_lock."""
+    changes = store.sync()
+    if changes is None:
+        app.logger.info("Data changed on disk; reloaded all records")
+        rebuild_indexes()
+        return
+    for kind, record in changes:
+        index_record(kind, record)
+    if changes:
+        data_version.bump()
+        app.logger.info("Picked up %s records written by other workers", len(changes))
+
+def commit_records(entries, durable=False, partial=False):
+    """Persist (kind, record) pairs together and fold them into the in-memory aggregates.
+
+    Writes are serialized across threads and worker processes by
+    write_lock; records other workers wrote first are applied before these
+    are appended, so every worker's view stays complete.
+
+    A record dated in a month sealed since it was built raises
+    ClosedPeriodError and nothing is committed; with partial, only such
+    records are left out, and they are returned as {position in entries:
+    error}.
+    """
+    rejected = {}
+    with write_lock:
+        started = time.monotonic()
+        apply_sync()
+        for position, (kind, record) in enumerate(entries):
+            try:
+                archive.check_open(record)
+            except ClosedPeriodError as e:
+                if not partial:
+                    raise
+                rejected[position] = e
+        if rejected:
+            entries = [entry for position, entry in enumerate(entries) if position not in rejected]
+        if not entries:
+            return rejected
+        with timed("save"):
+            store.append_many(entries, durable)
+        for kind, record in entries:
+            index_record(kind, record)
+        data_version.bump()
+        write_queue.record_flush(len(entries), time.monotonic() - started)
+    return rejected
+
+def build_record(kind, fields):
+    """Build a record of kind from submitted fields, as the entry forms do.
+
+    Raises ValueError if unit_price or quantity is not a number, TypeError or
+    AttributeError if a name or date is not text, and ClosedPeriodError if
+    the record is dated in a sealed month.
+    """
+    record = {}
+    for field in RECORD_FIELDS[kind]:
+        if field == AMOUNT_FIELDS[kind]:
+            record[field] = record["unit_price"] * record["quantity"]
+        elif field in NUMERIC_FIELDS:
+            record[field] = float(fields.get(field, 0))
+        elif field == DATE_FIELDS[kind]:
+            record[field] = fields.get(field, "")
+            if not isinstance(record[field], str):
+                raise TypeError(f"{field} must be text")
+        else:
+            record[field] = fields.get(field, "").strip()
+    record = make_record(kind, record)
+    archive.check_open(record)
+    return record
+
+def add_record(kind, record):
+    """Persist a new record as WRITE_DURABILITY asks."""
+    if WRITE_DURABILITY == "sync":
+        commit_records([(kind, record)], durable=True)
+    else:
+        write_queue.submit(kind, record, wait=WRITE_DURABILITY == "batched")
+
+
+class GroupCommitter:
+    """Queue of new records committed in batches by a background thread.
+
+    A batch is committed once it holds batch_size records or its first
+    record has waited interval seconds. Each process starts its own flusher
+    thread on first use.
+    """
+
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batches = 0
+        self.records = 0
+        self.failed = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the queue and flusher thread (a forked child gets its own)."""
+        self.queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, kind, record, wait):
+        """Queue a record; with wait, block until it is committed and re-raise any failure."""
+        self._start()
+        item = {"entry": (kind, record), "queued": time.monotonic(),
+                "done": threading.Event() if wait else None, "error": None}
+        self.queue.put(item)
+        if wait:
+            item["done"].wait()
+            if item["error"] is not None:
+                raise item["error"]
+
+    def flush(self):
+        """Wait until every queued record has been committed."""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.join()
+
+    def record_flush(self, count, seconds):
+        with self._stats_lock:
+            self.batches += 1
+            self.records += count
+            self.last_flush_seconds = seconds
+            self.max_flush_seconds = max(self.max_flush_seconds, seconds)
+            self.total_flush_seconds += seconds
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "durability": WRITE_DURABILITY,
+                "queue_depth": self.queue.qsize(),
+                "batches": self.batches,
+                "records": self.records,
+                "failed_records": self.failed,
+                "last_flush_seconds": self.last_flush_seconds,
+                "max_flush_seconds": self.max_flush_seconds,
+                "avg_flush_seconds": self.total_flush_seconds / self.batches if self.batches else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = batch[0]["queued"] + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        error = None
+        rejected = {}
+        try:
+            rejected = commit_records([item["entry"] for item in batch],
+                                      durable=WRITE_DURABILITY == "batched", partial=True)
+        except Exception as e:
+            error = e
+            app.logger.exception("Group commit of %s records failed", len(batch))
+        for position, e in rejected.items():
+            app.logger.error("Dropped queued %s: %s", batch[position]["entry"][0], e)
+        waited = time.monotonic() - batch[0]["queued"]
+        with self._stats_lock:
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.failed += len(batch) if error is not None else len(rejected)
+        for position, item in enumerate(batch):
+            item["error"] = rejected.get(position, error)
+            if item["done"] is not None:
+                item["done"].set()
+            self.queue.task_done()
+
+
+write_queue = GroupCommitter(WRITE_BATCH_SIZE, WRITE_BATCH_INTERVAL)
+# Registered after journal.close, so queued records are committed before it runs.
+atexit.register(write_queue.flush)
+
+@app.before_request
+def sync_with_other_workers():
+    if store.changed_on_disk():
+        with write_lock:
+            apply_sync()
+
+def reset_after_fork():
+    """Give a forked worker its own file handles and database connection."""
+    journal.forget_file()
+    write_queue.reset()
+    if isinstance(store, SQLiteStore):
+        store.connect()
+    if profiler is not None:
+        profiler.forget_thread()
 
 # Load data when the app starts.
-data = load_data()
-sales_records = data["sales_records"]
-purchase_records = data["purchase_records"]
-sale_return_records = data["sale_return_records"]
-purchase_return_records = data["purchase_return_records"]
+with write_lock:
+    archive = Archive(ARCHIVE_DIR)
+    store = open_store()
+totals = RunningTotals()
+inventory_index = InventoryIndex()
+cash_flow_rollup = CashFlowRollup()
+period_totals = PeriodTotals()
+analytics = ColumnarAnalytics() if numpy is not None and ANALYTICS_ENGINE == "numpy" else None
+# On SQLite these read records from the store on demand instead of holding them all.
+supplier_index = SupplierLedgerIndex(lazy=isinstance(store, SQLiteStore))
+sale_return_index = SaleReturnIndex(lazy=isinstance(store, SQLiteStore))
+rebuild_indexes()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+def paginate(kind, search_query=""):
+    """Fetch the page of a record list named by ?per_page=, ?after= and ?before=,
+    with links to the neighbouring pages."""
+    per_page = request.args.get("per_page", DEFAULT_PAGE_SIZE, type=int)
+    per_page = min(max(per_page, 1), MAX_PAGE_SIZE)
+    page = store.page(kind, search_query, request.args.get("after", type=int),
+                      request.args.get("before", type=int), per_page)
+    args = {"per_page": per_page}
+    if search_query:
+        args["search"] = search_query
+    page["per_page"] = per_page
+    page["prev_url"] = url_for(request.endpoint, before=page["prev"], **args) if page["prev"] is not None else None
+    page["next_url"] = url_for(request.endpoint, after=page["next"], **args) if page["next"] is not None else None
+    return page
 
 @app.route("/")
 def index():
-    return render_template("index.html", sales=sales_records)
+    page = paginate("sales_records")
+    return render_template("index.html", sales=list(zip(page["ids"], page["records"])), page=page)
 
 # ---------------- Sales Process ----------------
 @app.route("/sale", methods=["GET", "POST"])
@@ -83,36 +2987,19 @@ def sale():
 
     if request.method == "POST":
         try:
-            product_name = request.form.get("product_name", "").strip()
-            sale_date = request.form.get("sale_date", "")
-            unit_price = float(request.form.get("unit_price", 0))
-            quantity = float(request.form.get("quantity", 0))
-            total_sale = unit_price * quantity
-
-            record = {
-                "product_name": product_name,
-                "sale_date": sale_date,
-                "unit_price": unit_price,
-                "quantity": quantity,
-                "total_sale": total_sale
-            }
-            sales_records.append(record)
-            save_data()
+            record = build_record("sales_records", request.form)
+            add_record("sales_records", record)
             message = "Sale record added successfully!"
             app.logger.info("Added sale record: %s", record)
+        except ClosedPeriodError as e:
+            message = str(e)
+            app.logger.error("Error adding sale record: %s", e)
         except ValueError:
             message = "Invalid input. Please enter numeric values for price and quantity."
             app.logger.error("Error adding sale record: Invalid numeric input")
 
-    if search_query:
-        filtered_records = [
-            rec for rec in sales_records
-            if search_query.lower() in rec.get("product_name", "").lower() or search_query in rec.get("sale_date", "")
-        ]
-    else:
-        filtered_records = sales_records
-
-    return render_template("sale.html", records=filtered_records, message=message, search_query=search_query)
+    page = paginate("sales_records", search_query)
+    return render_template("sale.html", records=page["records"], page=page, message=message, search_query=search_query)
 
 # ---------------- Purchase Process ----------------
 @app.route("/purchase", methods=["GET", "POST"])
@@ -122,40 +3009,19 @@ def purchase():
 
     if request.method == "POST":
         try:
-            supplier_name = request.form.get("supplier_name", "").strip()
-            product_name = request.form.get("product_name", "").strip()
-            purchase_date = request.form.get("purchase_date", "")
-            unit_price = float(request.form.get("unit_price", 0))
-            quantity = float(request.form.get("quantity", 0))
-            total_purchase = unit_price * quantity
-
-            record = {
-                "supplier_name": supplier_name,
-                "product_name": product_name,
-                "purchase_date": purchase_date,
-                "unit_price": unit_price,
-                "quantity": quantity,
-                "total_purchase": total_purchase
-            }
-            purchase_records.append(record)
-            save_data()
+            record = build_record("purchase_records", request.form)
+            add_record("purchase_records", record)
             message = "Purchase record added successfully!"
             app.logger.info("Added purchase record: %s", record)
+        except ClosedPeriodError as e:
+            message = str(e)
+            app.logger.error("Error adding purchase record: %s", e)
         except ValueError:
             message = "Invalid input. Please enter numeric values for price and quantity."
             app.logger.error("Error adding purchase record: Invalid numeric input")
 
-    if search_query:
-        filtered_records = [
-            rec for rec in purchase_records
-            if (search_query.lower() in rec.get("product_name", "").lower() or
-                search_query.lower() in rec.get("supplier_name", "").lower() or
-                search_query in rec.get("purchase_date", ""))
-        ]
-    else:
-        filtered_records = purchase_records
-
-    return render_template("purchase.html", records=filtered_records, message=message, search_query=search_query)
+    page = paginate("purchase_records", search_query)
+    return render_template("purchase.html", records=page["records"], page=page, message=message, search_query=search_query)
 
 # ---------------- Sales Return Process ----------------
 @app.route("/sale-return", methods=["GET", "POST"])
@@ -163,27 +3029,18 @@ def sale_return():
     message = ""
     if request.method == "POST":
         try:
-            product_name = request.form.get("product_name", "").strip()
-            return_date = request.form.get("return_date", "")
-            unit_price = float(request.form.get("unit_price", 0))
-            quantity = float(request.form.get("quantity", 0))
-            refund_amount = unit_price * quantity
-
-            record = {
-                "product_name": product_name,
-                "return_date": return_date,
-                "unit_price": unit_price,
-                "quantity": quantity,
-                "refund_amount": refund_amount
-            }
-            sale_return_records.append(record)
-            save_data()
+            record = build_record("sale_return_records", request.form)
+            add_record("sale_return_records", record)
             message = "Sale return record added successfully!"
             app.logger.info("Added sale return record: %s", record)
+        except ClosedPeriodError as e:
+            message = str(e)
+            app.logger.error("Error adding sale return record: %s", e)
         except ValueError:
             message = "Invalid input. Please enter numeric values for price and quantity."
             app.logger.error("Error adding sale return record: Invalid numeric input")
-    return render_template("sale_return.html", records=sale_return_records, message=message)
+    page = paginate("sale_return_records")
+    return render_template("sale_return.html", records=page["records"], page=page, message=message)
 
 # ---------------- Purchase Return Process ----------------
 @app.route("/purchase-return", methods=["GET", "POST"])
@@ -191,32 +3048,48 @@ def purchase_return():
     message = ""
     if request.method == "POST":
         try:
-            supplier_name = request.form.get("supplier_name", "").strip()
-            product_name = request.form.get("product_name", "").strip()
-            return_date = request.form.get("return_date", "")
-            unit_price = float(request.form.get("unit_price", 0))
-            quantity = float(request.form.get("quantity", 0))
-            total_return = unit_price * quantity
-
-            record = {
-                "supplier_name": supplier_name,
-                "product_name": product_name,
-                "return_date": return_date,
-                "unit_price": unit_price,
-                "quantity": quantity,
-                "total_return": total_return
-            }
-            purchase_return_records.append(record)
-            save_data()
+            record = build_record("purchase_return_records", request.form)
+            add_record("purchase_return_records", record)
             message = "Purchase return record added successfully!"
             app.logger.info("Added purchase return record: %s", record)
+        except ClosedPeriodError as e:
+            message = str(e)
+            app.logger.error("Error adding purchase return record: %s", e)
         except ValueError:
             message = "Invalid input. Please enter numeric values for price and quantity."
             app.logger.error("Error adding purchase return record: Invalid numeric input")
-    return render_template("purchase_return.html", records=purchase_return_records, message=message)
+    page = paginate("purchase_return_records")
+    return render_template("purchase_return.html", records=page["records"], page=page, message=message)
+
+# ---------------- Report Periods ----------------
+def period_filter():
+    """The ?from= / ?to= dates (query or form) of a report, as inclusive YYYY-MM-DD strings.
+
+    Returns (date_from, date_to, error); an invalid range comes back
+    empty, with error set to the message each route reports its own way.
+    """
+    date_from = request.values.get("from", "").strip()
+    date_to = request.values.get("to", "").strip()
+    try:
+        for date_str in (date_from, date_to):
+            if date_str:
+                datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        app.logger.error("Invalid date range %s to %s on %s", date_from, date_to, request.path)
+        return "", "", "Invalid date range. Please use YYYY-MM-DD dates."
+    return date_from, date_to, None
 
 # ---------------- Profit Calculation ----------------
+def period_amounts(date_from="", date_to="", product=""):
+    """Money total of each record list, from the running totals or, when filtered, the prefix sums."""
+    if date_from or date_to or product:
+        return {kind: period_totals.total(kind, date_from, date_to, product) for kind in RECORD_KINDS}
+    if VERIFY_AGGREGATES:
+        totals.verify(LedgerView(store, archive))
+    return {kind: totals[kind] for kind in RECORD_KINDS}
+
 @app.route("/profit", methods=["GET", "POST"])
+@conditional_report
 def profit():
     message = ""
     operating_expenses = 0.0
@@ -227,12 +3100,17 @@ def profit():
             message = "Invalid input. Please enter numeric values for operating expenses."
             app.logger.error("Error in profit calculation: Invalid operating expenses input")
 
-    total_sales = sum(record["total_sale"] for record in sales_records)
-    total_sale_returns = sum(record["refund_amount"] for record in sale_return_records)
+    date_from, date_to, error = period_filter()
+    message = error or message
+    product = request.values.get("product", "").strip()
+    amounts = period_amounts(date_from, date_to, product)
+
+    total_sales = amounts["sales_records"]
+    total_sale_returns = amounts["sale_return_records"]
     net_sales = total_sales - total_sale_returns
 
-    total_purchases = sum(record["total_purchase"] for record in purchase_records)
-    total_purchase_returns = sum(record["total_return"] for record in purchase_return_records)
+    total_purchases = amounts["purchase_records"]
+    total_purchase_returns = amounts["purchase_return_records"]
     net_purchases = total_purchases - total_purchase_returns
 
     gross_profit = net_sales - net_purchases
@@ -250,8 +3128,9 @@ def profit():
         "net_profit": net_profit
     }
 
-    app.logger.info("Profit calculated: %s", result)
-    return render_template("profit.html", result=result, message=message)
+    app.logger.info("Profit calculated for %r to %r, product %r: %s", date_from, date_to, product, result)
+    return render_template("profit.html", result=result, message=message,
+                           date_from=date_from, date_to=date_to, product=product)
 
 # ---------------- Cash Flow Calculation ----------------
 @app.route("/cash-flow", methods=["GET", "POST"])
@@ -267,8 +3146,12 @@ def cash_flow():
             message = "Invalid input. Please enter numeric values."
             app.logger.error("Error in cash flow calculation: Invalid numeric input")
 
-    cash_inflow = sum(record["total_sale"] for record in sales_records) - sum(record["refund_amount"] for record in sale_return_records)
-    cash_outflow = (sum(record["total_purchase"] for record in purchase_records) - sum(record["total_return"] for record in purchase_return_records)) + additional_outflow
+    date_from, date_to, error = period_filter()
+    message = error or message
+    amounts = period_amounts(date_from, date_to)
+
+    cash_inflow = amounts["sales_records"] - amounts["sale_return_records"]
+    cash_outflow = (amounts["purchase_records"] - amounts["purchase_return_records"]) + additional_outflow
     closing_balance = opening_balance + cash_inflow - cash_outflow
 
     result = {
@@ -278,166 +3161,88 @@ def cash_flow():
         "additional_outflow": additional_outflow,
         "closing_balance": closing_balance
     }
-    app.logger.info("Cash flow calculated: %s", result)
-    return render_template("cash_flow.html", result=result, message=message)
+    app.logger.info("Cash flow calculated for %r to %r: %s", date_from, date_to, result)
+    return render_template("cash_flow.html", result=result, message=message, date_from=date_from, date_to=date_to)
 
 # ---------------- Cash Flow Report ----------------
 @app.route("/cash-flow-report")
+@conditional_report
 def cash_flow_report():
-    daily_flow = {}
-    # Process Sales (inflow)
-    for rec in sales_records:
-        date_str = rec.get("sale_date", "")
-        if date_str:
-            daily_flow.setdefault(date_str, {"inflow": 0, "outflow": 0})
-            daily_flow[date_str]["inflow"] += rec.get("total_sale", 0)
-    # Process Sale Returns (reduce inflow)
-    for rec in sale_return_records:
-        date_str = rec.get("return_date", "")
-        if date_str:
-            daily_flow.setdefault(date_str, {"inflow": 0, "outflow": 0})
-            daily_flow[date_str]["inflow"] -= rec.get("refund_amount", 0)
-    # Process Purchases (outflow)
-    for rec in purchase_records:
-        date_str = rec.get("purchase_date", "")
-        if date_str:
-            daily_flow.setdefault(date_str, {"inflow": 0, "outflow": 0})
-            daily_flow[date_str]["outflow"] += rec.get("total_purchase", 0)
-    # Process Purchase Returns (reduce outflow)
-    for rec in purchase_return_records:
-        date_str = rec.get("return_date", "")
-        if date_str:
-            daily_flow.setdefault(date_str, {"inflow": 0, "outflow": 0})
-            daily_flow[date_str]["outflow"] -= rec.get("total_return", 0)
-
-    # Convert daily_flow to a sorted list
-    daily_flow_sorted = sorted(daily_flow.items(), key=lambda x: x[0])
-    daily_flow_list = []
-    for date_str, flow in daily_flow_sorted:
-        net = flow["inflow"] - flow["outflow"]
-        daily_flow_list.append({
-            "date": date_str,
-            "inflow": flow["inflow"],
-            "outflow": flow["outflow"],
-            "net": net
-        })
-
-    # Group by week (using ISO week)
-    weekly_flow = {}
-    for date_str, flow in daily_flow.items():
-        try:
-            dt = datetime.strptime(date_str, "%Y-%m-%d")
-        except ValueError:
-            continue
-        iso_year, iso_week, _ = dt.isocalendar()
-        week_key = f"{iso_year}-W{iso_week}"
-        weekly_flow.setdefault(week_key, {"inflow": 0, "outflow": 0})
-        weekly_flow[week_key]["inflow"] += flow["inflow"]
-        weekly_flow[week_key]["outflow"] += flow["outflow"]
-
-    weekly_flow_sorted = sorted(weekly_flow.items(), key=lambda x: x[0])
-    weekly_flow_list = []
-    for week_key, flow in weekly_flow_sorted:
-        net = flow["inflow"] - flow["outflow"]
-        weekly_flow_list.append({
-            "week": week_key,
-            "inflow": flow["inflow"],
-            "outflow": flow["outflow"],
-            "net": net
-        })
-
-    app.logger.info("Cash flow report generated: Daily: %s, Weekly: %s", daily_flow_list, weekly_flow_list)
-    return render_template("cash_flow_report.html", daily_flow=daily_flow_list, weekly_flow=weekly_flow_list)
+    date_from, date_to, error = period_filter()
+    message = error or ""
+
+    daily_flow_list, weekly_flow_list, monthly_flow_list = cash_flow_rollup.report(date_from, date_to)
+
+    app.logger.info("Cash flow report generated: %s days, %s weeks, %s months",
+                    len(daily_flow_list), len(weekly_flow_list), len(monthly_flow_list))
+    return render_template("cash_flow_report.html", daily_flow=daily_flow_list, weekly_flow=weekly_flow_list,
+                           monthly_flow=monthly_flow_list, date_from=date_from, date_to=date_to, message=message)
+
+# ---------------- Analytics ----------------
+@app.route("/analytics")
+def analytics_report():
+    """Profit and stock figures as JSON, overall or per ?group=product|supplier|day|month,
+    optionally limited to ?from= and ?to= (inclusive YYYY-MM-DD dates)."""
+    group = request.args.get("group") or None
+    if group is not None and group not in ANALYTICS_GROUPS:
+        return jsonify(error=f"group must be one of {', '.join(ANALYTICS_GROUPS)}"), 400
+    date_from, date_to, error = period_filter()
+    if error:
+        return jsonify(error=error), 400
+    rows = analytics_rows(group, date_from, date_to)
+    engine = "numpy" if analytics is not None else "python"
+    app.logger.info("Analytics by %s from %r to %r computed with %s", group, date_from, date_to, engine)
+    if group is None:
+        return jsonify(engine=engine, totals=rows[0])
+    return jsonify(engine=engine, rows=rows)
 
 # ---------------- Inventory ----------------
 @app.route("/inventory")
+@conditional_report
 def inventory():
-    inventory_summary = {}
-
-    for rec in purchase_records:
-        product = rec.get("product_name", "")
-        if product:
-            inventory_summary.setdefault(product, {"purchased": 0, "purchase_returns": 0, "sold": 0, "sales_returns": 0})
-            inventory_summary[product]["purchased"] += rec.get("quantity", 0)
-
-    for rec in purchase_return_records:
-        product = rec.get("product_name", "")
-        if product:
-            inventory_summary.setdefault(product, {"purchased": 0, "purchase_returns": 0, "sold": 0, "sales_returns": 0})
-            inventory_summary[product]["purchase_returns"] += rec.get("quantity", 0)
-
-    for rec in sales_records:
-        product = rec.get("product_name", "")
-        if product:
-            inventory_summary.setdefault(product, {"purchased": 0, "purchase_returns": 0, "sold": 0, "sales_returns": 0})
-            inventory_summary[product]["sold"] += rec.get("quantity", 0)
-
-    for rec in sale_return_records:
-        product = rec.get("product_name", "")
-        if product:
-            inventory_summary.setdefault(product, {"purchased": 0, "purchase_returns": 0, "sold": 0, "sales_returns": 0})
-            inventory_summary[product]["sales_returns"] += rec.get("quantity", 0)
-
-    for product, data in inventory_summary.items():
-        data["current_inventory"] = data["purchased"] - data["purchase_returns"] - data["sold"] + data["sales_returns"]
+    message = ""
+    low_stock = request.args.get("low_stock", "").strip()
+    inventory_summary = inventory_index.all()
+    if low_stock:
+        try:
+            inventory_summary = inventory_index.low_stock(float(low_stock))
+        except ValueError:
+            message = "Invalid input. Please enter a numeric low-stock threshold."
+            app.logger.error("Error in inventory report: Invalid low-stock threshold")
 
     app.logger.info("Inventory report generated")
-    return render_template("inventory.html", summary=inventory_summary)
+    return render_template("inventory.html", summary=inventory_summary, message=message, low_stock=low_stock)
+
+@app.route("/inventory/<product_name>")
+def inventory_product(product_name):
+    data = inventory_index.get(product_name)
+    if data is None:
+        app.logger.error("No inventory found for product %s", product_name)
+        return "Product not found", 404
+    return jsonify(product_name=product_name, **data)
 
 # ---------------- Supplier Ledger ----------------
 @app.route("/supplier-ledger")
+@conditional_report
 def supplier_ledger():
-    ledger = {}
-    # Process purchase records
-    for rec in purchase_records:
-        supplier = rec.get("supplier_name", "").strip()
-        if supplier:
-            ledger.setdefault(supplier, {"purchases": [], "purchase_returns": []})
-            ledger[supplier]["purchases"].append(rec)
-    # Process purchase return records
-    for rec in purchase_return_records:
-        supplier = rec.get("supplier_name", "").strip()
-        if supplier:
-            ledger.setdefault(supplier, {"purchases": [], "purchase_returns": []})
-            ledger[supplier]["purchase_returns"].append(rec)
-    # Calculate sums for each supplier
-    for supplier, data in ledger.items():
-        total_purchase = sum(item["total_purchase"] for item in data["purchases"])
-        total_return = sum(item["total_return"] for item in data["purchase_returns"])
-        net = total_purchase - total_return
-        data["total_purchase"] = total_purchase
-        data["total_return"] = total_return
-        data["net"] = net
     app.logger.info("Supplier ledger generated")
-    return render_template("supplier_ledger.html", ledger=ledger)
+    return render_template("supplier_ledger.html", ledger=supplier_index.ledger(detail=True))
 
 # ---------------- Aggregated Supplier Ledger PDF ----------------
 @app.route("/supplier-ledger/pdf")
+@conditional_report
 def supplier_ledger_pdf():
-    # Generate an aggregated ledger for all suppliers.
-    ledger = {}
-    for rec in purchase_records:
-        supplier = rec.get("supplier_name", "").strip()
-        if supplier:
-            ledger.setdefault(supplier, {"purchases": [], "purchase_returns": []})
-            ledger[supplier]["purchases"].append(rec)
-    for rec in purchase_return_records:
-        supplier = rec.get("supplier_name", "").strip()
-        if supplier:
-            ledger.setdefault(supplier, {"purchases": [], "purchase_returns": []})
-            ledger[supplier]["purchase_returns"].append(rec)
-    # Calculate sums for each supplier
-    for supplier, data in ledger.items():
-        total_purchase = sum(item["total_purchase"] for item in data["purchases"])
-        total_return = sum(item["total_return"] for item in data["purchase_returns"])
-        net = total_purchase - total_return
-        data["total_purchase"] = total_purchase
-        data["total_return"] = total_return
-        data["net"] = net
+    ledger = supplier_index.ledger()
+    summary = [[supplier, data["total_purchase"], data["total_return"], data["net"]] for supplier, data in ledger.items()]
+    response = cached_pdf("supplier_ledgers", summary, [("suppliers",)],
+                          lambda output: create_ledgers_pdf(ledger, output), "supplier_ledgers.pdf")
+    app.logger.info("Aggregated Supplier ledger PDF generated")
+    return response
 
+def create_ledgers_pdf(ledger, output):
+    """Draw the one-line-per-supplier summary of every ledger into output (a path or file object)."""
     # Create the aggregated PDF using the canvas.
-    pdf_path = os.path.join(BASE_DIR, "supplier_ledgers.pdf")
-    c = canvas.Canvas(pdf_path, pagesize=letter)
+    c = canvas.Canvas(output, pagesize=letter)
     c.setFont("Helvetica", 12)
     y = 750
     c.drawString(50, y, "Supplier Ledgers")
@@ -456,18 +3261,17 @@ def supplier_ledger_pdf():
         c.drawString(70, y, f"Net Amount: {data['net']}")
         y -= 30
     c.save()
-    app.logger.info("Aggregated Supplier ledger PDF generated")
-    return send_file(pdf_path, as_attachment=True)
 
 # ---------------- Supplier Ledger PDF for a Separate Supplier ----------------
 def format_number(n):
     """Format a number with commas (without decimals)."""
     return "{:,.0f}".format(n) if n else ""
 
-def create_pdf(transactions, filename):
+def create_pdf(transactions, output):
     """
     Creates a PDF with an Excel-like grid based on the transactions.
     The table now has separate columns for purchase and return values.
+    output may be a file path or a writable file object.
     """
     # Calculate totals separately for purchase and returns
     total_quantity = sum(t.get("quantity", 0) for t in transactions)
@@ -504,7 +3308,7 @@ def create_pdf(transactions, filename):
     totals_row = ["TOTAL", "", format_number(total_quantity), "", format_number(total_purchase), format_number(total_return)]
     table_data.append(totals_row)
 
-    doc = SimpleDocTemplate(filename, pagesize=letter)
+    doc = SimpleDocTemplate(output, pagesize=letter)
     styles = getSampleStyleSheet()
 
     big_header_style = ParagraphStyle(
@@ -541,48 +3345,29 @@ def create_pdf(transactions, filename):
     elements.append(footer)
 
     doc.build(elements)
-    print(f"PDF generated successfully as {filename}")
 
 @app.route("/supplier-ledger/<supplier_name>/pdf")
+@conditional_report
 def supplier_ledger_supplier_pdf(supplier_name):
     supplier = supplier_name.strip()
-    transactions = []
-    for rec in purchase_records:
-        if rec.get("supplier_name", "").strip().lower() == supplier.lower():
-            transactions.append({
-                "date": rec.get("purchase_date", ""),
-                "product": rec.get("product_name", ""),
-                "quantity": rec.get("quantity", 0),
-                "balance": rec.get("total_purchase", 0)
-            })
-    for rec in purchase_return_records:
-        if rec.get("supplier_name", "").strip().lower() == supplier.lower():
-            transactions.append({
-                "date": rec.get("return_date", ""),
-                "product": rec.get("product_name", ""),
-                "quantity": rec.get("quantity", 0),
-                "balance": rec.get("total_return", 0),
-                "credit": rec.get("total_return", 0)
-            })
-    if not transactions:
+    data = supplier_index.detail(supplier)
+    if data is None:
         app.logger.error("No ledger records found for supplier %s", supplier)
         return "No ledger records found for supplier", 404
+    transactions = data["transactions"]
 
-    try:
-        transactions.sort(key=lambda x: datetime.strptime(x["date"], "%Y-%m-%d"))
-    except Exception as e:
-        app.logger.warning("Could not sort transactions by date: %s", e)
-
-    pdf_path = os.path.join(BASE_DIR, f"supplier_ledger_{supplier.replace(' ', '_')}.pdf")
-    create_pdf(transactions, pdf_path)
+    response = cached_pdf("supplier_ledger", transactions, [("supplier", supplier.lower())],
+                          lambda output: create_pdf(transactions, output),
+                          f"supplier_ledger_{supplier.replace(' ', '_')}.pdf")
     app.logger.info("Supplier ledger PDF generated for supplier %s using create_pdf", supplier)
-    return send_file(pdf_path, as_attachment=True)
+    return response
 
 # ---------------- Invoice Generation Using Platypus ----------------
-def create_invoice_pdf(invoice, output_filename="invoice.pdf"):
+def create_invoice_pdf(invoice, output="invoice.pdf"):
     # Create a document template with A4 page size and margins.
+    # output may be a file path or a writable file object.
     doc = SimpleDocTemplate(
-        output_filename,
+        output,
         pagesize=A4,
         rightMargin=1.5*cm,
         leftMargin=1.5*cm,
@@ -699,72 +3484,573 @@ def create_invoice_pdf(invoice, output_filename="invoice.pdf"):
         elements.append(Paragraph(invoice["footer_note"], style_normal))
 
     doc.build(elements)
-    print(f"Invoice PDF generated: {output_filename}")
+
+def find_record(kind, record_id):
+    """The record of kind with an id, from the store or else the sealed months; None if there is none."""
+    record = store.get(kind, record_id)
+    if record is None:
+        record = archive.get(kind, record_id)
+    return record
 
 @app.route("/invoice/<int:sale_id>")
 def invoice(sale_id):
-    if 0 <= sale_id < len(sales_records):
-        sale = sales_records[sale_id]
+    sale = find_record("sales_records", sale_id)
+    if sale is not None:
         app.logger.info("Generating invoice for sale_id %s", sale_id)
         return render_template("invoice.html", sale=sale, sale_id=sale_id)
     app.logger.error("Invoice not found for sale_id %s", sale_id)
     return "Invoice not found", 404
 
+def build_invoice(sale):
+    """The invoice dictionary create_invoice_pdf draws for a sale."""
+    # Build the invoice dictionary based on the sale record.
+    invoice = {
+        "company_name": "Jibreel International (PVT) LTD.",
+        "invoice_title": "INVOICE",
+        "company_address": "Building W2R4+GWG Orangi Town, Karachi, Pakistan",
+        "company_tel": "0312-2157698",
+        "company_email": "info@jibreelinternational.com",
+        # "buyer_name": "Valued Customer",
+        # "buyer_address": "Customer Address",
+        "serial_no": str(sale.id),
+        "date": sale["sale_date"],
+        "line_items": [
+            {
+                "quantity": sale["quantity"],
+                "description": sale["product_name"],
+                "unit_price": sale["unit_price"],
+                "value_excl_tax": sale["unit_price"] * sale["quantity"]
+            }
+        ],
+        "total_value_excl_tax": sale["unit_price"] * sale["quantity"],
+        "total_sales_tax": 0.00,
+        "total_value_incl_tax": sale["total_sale"],
+        "footer_note": "Jibreel International (PVT) LTD: █________________________________________█"
+    }
+
+    # --- NEW CODE: Add sale returns information ---
+    returns = []
+    if sale.parsed_date:
+        returns = sale_return_index.since(sale["product_name"], sale.parsed_date)
+        if archive.sealed(sale):
+            sealed = [rec for rec in archive.records("sale_return_records", sale.parsed_date.strftime("%Y-%m-%d"),
+                                                     names={"product_name": sale["product_name"]})
+                      if rec.parsed_date and rec.parsed_date >= sale.parsed_date]
+            returns = sorted(sealed + returns, key=lambda rec: rec.id)
+    invoice["returns"] = returns
+    # --- END NEW CODE ---
+    return invoice
+
 @app.route("/invoice/<int:sale_id>/pdf")
+@conditional_report
 def generate_invoice_pdf(sale_id):
-    if 0 <= sale_id < len(sales_records):
-        sale = sales_records[sale_id]
-        # Build the invoice dictionary based on the sale record.
-        invoice = {
-            "company_name": "Jibreel International (PVT) LTD.",
-            "invoice_title": "INVOICE",
-            "company_address": "Building W2R4+GWG Orangi Town, Karachi, Pakistan",
-            "company_tel": "0312-2157698",
-            "company_email": "info@jibreelinternational.com",
-            # "buyer_name": "Valued Customer",
-            # "buyer_address": "Customer Address",
-            "serial_no": str(sale_id),
-            "date": sale["sale_date"],
-            "line_items": [
-                {
-                    "quantity": sale["quantity"],
-                    "description": sale["product_name"],
-                    "unit_price": sale["unit_price"],
-                    "value_excl_tax": sale["unit_price"] * sale["quantity"]
-                }
-            ],
-            "total_value_excl_tax": sale["unit_price"] * sale["quantity"],
-            "total_sales_tax": 0.00,
-            "total_value_incl_tax": sale["total_sale"],
-            "footer_note": "Jibreel International (PVT) LTD: █________________________________________█"
-        }
-
-        # --- NEW CODE: Add sale returns information ---
-        try:
-            sale_date_obj = datetime.strptime(sale["sale_date"], "%Y-%m-%d")
-        except Exception as e:
-            sale_date_obj = None
-
-        returns = []
-        if sale_date_obj:
-            for ret in sale_return_records:
-                if ret.get("product_name", "").strip().lower() == sale["product_name"].strip().lower():
-                    try:
-                        ret_date = datetime.strptime(ret.get("return_date", ""), "%Y-%m-%d")
-                        if ret_date >= sale_date_obj:
-                            returns.append(ret)
-                    except Exception:
-                        continue
-        invoice["returns"] = returns
-        # --- END NEW CODE ---
-
-        pdf_path = os.path.join(BASE_DIR, f"invoice_{sale_id}.pdf")
-        create_invoice_pdf(invoice, pdf_path)
+    sale = find_record("sales_records", sale_id)
+    if sale is not None:
+        invoice = build_invoice(sale)
+        response = cached_pdf("invoice", invoice, [("product", sale.product_key)],
+                              lambda output: create_invoice_pdf(invoice, output), f"invoice_{sale_id}.pdf")
         app.logger.info("Invoice PDF generated for sale_id %s using create_invoice_pdf", sale_id)
-        return send_file(pdf_path, as_attachment=True)
+        return response
     app.logger.error("Invoice PDF not found for sale_id %s", sale_id)
     return "Invoice not found", 404
 
+# ---------------- Batch PDFs ----------------
+# Processes rendering a batch of PDFs; 0 means one per CPU.
+PDF_BATCH_WORKERS = int(os.environ.get("PDF_BATCH_WORKERS", "0")) or os.cpu_count() or 1
+# Largest number of documents one batch may hold.
+PDF_BATCH_MAX_DOCUMENTS = int(os.environ.get("PDF_BATCH_MAX_DOCUMENTS", "2000"))
+PDF_BATCH_FORMATS = {"zip": "application/zip", "pdf": "application/pdf"}
+
+# The draw function behind each pdf_cache name a batch can render.
+PDF_RENDERERS = {"invoice": create_invoice_pdf, "supplier_ledger": create_pdf}
+
+def render_pdf(name, inputs):
+    """Render one PDF to bytes. Runs in a batch worker process."""
+    output = io.BytesIO()
+    PDF_RENDERERS[name](inputs, output)
+    return output.getvalue()
+
+def batch_sales(first_id=None, last_id=None, date_from="", date_to=""):
+    """The sales in an inclusive sale id and/or sale_date range.
+
+    Raises ValueError if first_id is past last_id, or if the id range
+    spans or the batch holds more than PDF_BATCH_MAX_DOCUMENTS sales.
+    """
+    too_large = ValueError(f"Batch too large; at most {PDF_BATCH_MAX_DOCUMENTS} documents")
+    if first_id is not None or last_id is not None:
+        first_id = max(first_id or 0, 0)
+        if last_id is None:
+            last_id = store.last_id("sales_records")
+        if first_id > last_id:
+            raise ValueError("Invalid sale id range. first must not be greater than last.")
+        if last_id - first_id + 1 > PDF_BATCH_MAX_DOCUMENTS:
+            raise too_large
+        sales = (find_record("sales_records", sale_id) for sale_id in range(first_id, last_id + 1))
+    else:
+        sales = itertools.chain(archive.records("sales_records", date_from, date_to), store.all("sales_records"))
+    sales = [sale for sale in sales
+             if sale is not None
+             and not (date_from and sale["sale_date"] < date_from)
+             and not (date_to and sale["sale_date"] > date_to)]
+    if len(sales) > PDF_BATCH_MAX_DOCUMENTS:
+        raise too_large
+    return sales
+
+def invoice_batch(sales):
+    """Invoice documents for sales."""
+    return [{"name": "invoice", "inputs": build_invoice(sale), "tags": [("product", sale.product_key)],
+             "filename": f"invoice_{sale.id}.pdf"}
+            for sale in sales]
+
+def supplier_ledger_batch():
+    """One ledger document per supplier."""
+    return [{"name": "supplier_ledger", "inputs": data["transactions"], "tags": [("supplier", supplier.strip().lower())],
+             "filename": f"supplier_ledger_{supplier.replace(' ', '_').replace('/', '_')}.pdf"}
+            for supplier, data in supplier_index.ledger(detail=True).items()]
+
+def render_batch(documents, progress=None):
+    """Yield (document, PDF bytes) in order, rendering cache misses across a process pool.
+
+    progress(done, total) is called after each document.
+    """
+    keys = [pdf_cache.key(doc["name"], doc["inputs"]) for doc in documents]
+    cached = [pdf_cache.get(key) for key in keys]
+    misses = [doc for doc, data in zip(documents, cached) if data is None]
+    pool = None
+    if misses:
+        # Forked workers inherit the render functions without re-importing the app.
+        context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+        pool = ProcessPoolExecutor(min(PDF_BATCH_WORKERS, len(misses)), mp_context=context)
+        rendered = pool.map(render_pdf, [doc["name"] for doc in misses], [doc["inputs"] for doc in misses],
+                            chunksize=max(1, len(misses) // (PDF_BATCH_WORKERS * 4)))
+    try:
+        for done, (doc, key, data) in enumerate(zip(documents, keys, cached), 1):
+            if data is None:
+                data = next(rendered)
+                pdf_cache.put(key, data, doc["tags"])
+            if progress is not None:
+                progress(done, len(documents))
+            yield doc, data
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+class ChunkSink:
+    """Write-only file object collecting what is written, for streaming a ZIP as it is built."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def zip_batch(rendered):
+    """Stream a ZIP archive of (document, PDF bytes) pairs, one member at a time."""
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        for doc, data in rendered:
+            archive.writestr(doc["filename"], data)
+            yield sink.take()
+    yield sink.take()
+
+def merge_batch(rendered, output):
+    """Write (document, PDF bytes) pairs into output as one PDF. Needs pypdf."""
+    writer = PdfWriter()
+    for doc, data in rendered:
+        writer.append(io.BytesIO(data))
+    with timed("pdf"):
+        writer.write(output)
+
+def batch_progress(label):
+    """A render_batch progress callback that logs every tenth of the way."""
+    def progress(done, total):
+        if done == total or done % max(1, total // 10) == 0:
+            app.logger.info("%s: %s of %s PDFs ready", label, done, total)
+    return progress
+
+@app.route("/pdf-batch/<name>")
+@conditional_report
+def pdf_batch(name):
+    """Render many PDFs in one job, as a streamed ZIP (?format=zip) or one merged PDF (?format=pdf).
+
+    /pdf-batch/invoices takes ?first= and ?last= sale_ids and ?from= and
+    ?to= sale dates; /pdf-batch/supplier-ledgers renders every supplier's
+    ledger. X-Batch-Documents carries the document count, so clients can
+    follow progress as ZIP members arrive.
+    """
+    fmt = request.args.get("format", "zip")
+    if fmt not in PDF_BATCH_FORMATS:
+        return "Unknown batch format", 400
+    if fmt == "pdf" and PdfWriter is None:
+        return "Merged PDFs need the pypdf package; use format=zip", 400
+    if name == "invoices":
+        date_from, date_to, error = period_filter()
+        if error:
+            return error, 400
+        try:
+            first_id, last_id = (int(request.args[arg]) if request.args.get(arg, "").strip() else None
+                                 for arg in ("first", "last"))
+        except ValueError:
+            return "Invalid sale id range. Please use whole numbers.", 400
+        # Refuse an oversized batch before building any of its invoices.
+        try:
+            sales = batch_sales(first_id, last_id, date_from, date_to)
+        except ValueError as e:
+            return str(e), 400
+        documents = invoice_batch(sales)
+    elif name == "supplier-ledgers":
+        documents = supplier_ledger_batch()
+    else:
+        return "Unknown batch", 404
+    if len(documents) > PDF_BATCH_MAX_DOCUMENTS:
+        return f"Batch too large; at most {PDF_BATCH_MAX_DOCUMENTS} documents", 400
+
+    app.logger.info("Rendering a batch of %s %s PDFs", len(documents), name)
+    rendered = render_batch(documents, batch_progress(f"Batch {name}"))
+    headers = {"X-Batch-Documents": str(len(documents))}
+    if fmt == "zip":
+        headers["Content-Disposition"] = f"attachment; filename={name}.zip"
+        return app.response_class(zip_batch(rendered), mimetype=PDF_BATCH_FORMATS[fmt], headers=headers)
+    output = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+    merge_batch(rendered, output)
+    output.seek(0)
+    response = send_file(output, mimetype="application/pdf", as_attachment=True, download_name=f"{name}.pdf")
+    response.headers.update(headers)
+    return response
+
+@app.cli.command("render-pdfs")
+@click.argument("name", type=click.Choice(["invoices", "supplier-ledgers"]))
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.option("--first", type=int, help="First sale_id (invoices).")
+@click.option("--last", type=int, help="Last sale_id (invoices).")
+@click.option("--from", "date_from", default="", help="First sale date, YYYY-MM-DD (invoices).")
+@click.option("--to", "date_to", default="", help="Last sale date, YYYY-MM-DD (invoices).")
+def render_pdfs_command(name, output, first, last, date_from, date_to):
+    """Render NAME PDFs into OUTPUT, a .zip archive or (with pypdf) one merged .pdf."""
+    merged = output.lower().endswith(".pdf")
+    if merged and PdfWriter is None:
+        raise click.ClickException("Merged PDFs need the pypdf package; write a .zip instead.")
+    if name == "invoices":
+        try:
+            documents = invoice_batch(batch_sales(first, last, date_from, date_to))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    else:
+        documents = supplier_ledger_batch()
+    with click.progressbar(length=len(documents), label=f"Rendering {name}") as bar:
+        rendered = render_batch(documents, lambda done, total: bar.update(1))
+        with open(output, "wb") as out:
+            if merged:
+                merge_batch(rendered, out)
+            else:
+                for chunk in zip_batch(rendered):
+                    out.write(chunk)
+    click.echo(f"Wrote {len(documents)} PDFs to {output}.")
+
+# ---------------- Bulk Import ----------------
+IMPORT_FORMATS = ("csv", "jsonl")
+# Invalid rows reported back per import, at most.
+MAX_IMPORT_ERRORS = 100
+
+def import_format(filename):
+    """Guess the import format from a file name."""
+    if filename.lower().endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return "csv"
+
+def read_import_rows(stream, fmt):
+    """Yield (line number, fields) for each row of a binary CSV or JSON-lines stream.
+
+    CSV files need a header row naming the record fields. A JSON line that
+    does not parse is yielded with fields None.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for fields in reader:
+            yield reader.line_num, {k: v for k, v in fields.items() if k is not None and v is not None}
+        return
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+def import_records(kind, rows):
+    """Validate rows as the entry forms do and commit them all in one batch.
+
+    Returns (number imported, error messages). Nothing is committed if any
+    row is invalid.
+    """
+    entries = []
+    errors = []
+    invalid = 0
+    for line_number, fields in rows:
+        if not isinstance(fields, dict):
+            error = "not a JSON object"
+        else:
+            try:
+                entries.append((kind, build_record(kind, fields)))
+                continue
+            except ClosedPeriodError as e:
+                error = str(e)
+            except ValueError:
+                error = "unit_price and quantity must be numbers"
+            except (TypeError, AttributeError):
+                error = "names and dates must be text"
+        invalid += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append(f"line {line_number}: {error}")
+    if invalid:
+        if invalid > len(errors):
+            errors.append(f"... and {invalid - len(errors)} more invalid rows")
+        app.logger.error("Rejected import of %s: %s invalid rows", kind, invalid)
+        return 0, errors
+    if entries:
+        commit_records(entries, durable=True)
+    app.logger.info("Imported %s %s", len(entries), kind)
+    return len(entries), []
+
+@app.route("/import/<kind_name>", methods=["POST"])
+def import_upload(kind_name):
+    """Import a CSV or JSON-lines file, sent as the "file" form field or as the request body."""
+    kind = URL_RECORD_KINDS.get(kind_name)
+    if kind is None:
+        return "Unknown record type", 404
+    upload = request.files.get("file")
+    fmt = request.args.get("format") or import_format((upload.filename or "") if upload else "")
+    if fmt not in IMPORT_FORMATS:
+        return jsonify(imported=0, errors=[f"unknown format {fmt!r}"]), 400
+    stream = upload.stream if upload else request.stream
+    imported, errors = import_records(kind, read_import_rows(stream, fmt))
+    if errors:
+        return jsonify(imported=0, errors=errors), 400
+    return jsonify(imported=imported)
+
+@app.cli.command("import-records")
+@click.argument("kind_name", type=click.Choice(sorted(URL_RECORD_KINDS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(IMPORT_FORMATS),
+              help="File format; guessed from the file name if omitted.")
+def import_command(kind_name, path, fmt):
+    """Import KIND_NAME records from the CSV or JSON-lines file PATH."""
+    with open(path, "rb") as stream:
+        imported, errors = import_records(URL_RECORD_KINDS[kind_name],
+                                          read_import_rows(stream, fmt or import_format(path)))
+    if errors:
+        for error in errors:
+            click.echo(error, err=True)
+        raise click.ClickException("Nothing imported.")
+    click.echo(f"Imported {imported} records.")
+
+# ---------------- Export ----------------
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+# Rows sent per chunk of a streamed export.
+EXPORT_CHUNK_ROWS = 500
+
+def export_lines(columns, rows, fmt):
+    """Encode rows (dicts) as CSV with a header row, or as JSON lines, a chunk at a time."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns, extrasaction="ignore")
+    if fmt == "csv":
+        writer.writeheader()
+    count = 0
+    for row in rows:
+        if fmt == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(row)) + "\n")
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@app.route("/export/<name>")
+def export(name):
+    """Stream a record list, the inventory summary or a cash-flow rollup as CSV or JSON lines.
+
+    Record lists take ?from= and ?to= (inclusive YYYY-MM-DD dates),
+    ?product= and ?supplier=; inventory takes ?product=; cash-flow takes
+    ?from=, ?to= and ?period=daily|weekly|monthly.
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return "Unknown export format", 400
+    date_from, date_to, error = period_filter()
+    if error:
+        return error, 400
+    product = request.args.get("product", "").strip()
+    supplier = request.args.get("supplier", "").strip()
+
+    if name in URL_RECORD_KINDS:
+        kind = URL_RECORD_KINDS[name]
+        names = {}
+        if product:
+            names["product_name"] = product
+        if supplier:
+            if "supplier_name" not in RECORD_FIELDS[kind]:
+                return "This record type has no supplier", 400
+            names["supplier_name"] = supplier
+        columns = ("id",) + RECORD_FIELDS[kind]
+        rows = itertools.chain(archive.records(kind, date_from, date_to, names),
+                               store.export(kind, date_from, date_to, names))
+    elif name == "inventory":
+        if date_from or date_to or supplier:
+            return "Inventory can only be filtered by product", 400
+        columns = ("product_name",) + tuple(column for _, column in InventoryIndex.COLUMNS) + ("current_inventory",)
+        rows = [dict(product_name=product_name, **data) for product_name, data in inventory_index.all().items()
+                if not product or product_name.strip().lower() == product.lower()]
+    elif name == "cash-flow":
+        period = request.args.get("period", "daily")
+        periods = ("daily", "weekly", "monthly")
+        if period not in periods or product or supplier:
+            return "Cash flow exports take from, to and period=daily|weekly|monthly", 400
+        rows = cash_flow_rollup.report(date_from, date_to)[periods.index(period)]
+        columns = ({"daily": "date", "weekly": "week", "monthly": "month"}[period], "inflow", "outflow", "net")
+    else:
+        return "Unknown export", 404
+
+    app.logger.info("Export of %s as %s started", name, fmt)
+    return app.response_class(export_lines(columns, rows, fmt), mimetype=EXPORT_FORMATS[fmt],
+                              headers={"Content-Disposition": f"attachment; filename={name}.{fmt}"})
+
+# ---------------- Sealing Periods ----------------
+def seal_periods(through):
+    """Move the records dated in every month up to through (YYYY-MM) out of
+    the store into sealed archive segments. Needs a JSON storage backend.
+
+    Months sealed earlier are left as they are. Returns the months that got
+    a new segment.
+    """
+    with write_lock:
+        apply_sync()
+        if through <= archive.sealed_through:
+            return []
+        sealed = {}
+        ids = {kind: set() for kind in RECORD_KINDS}
+        for kind in RECORD_KINDS:
+            for rec in store.all(kind):
+                month = month_of(rec)
+                if month is not None and archive.sealed_through < month <= through:
+                    sealed.setdefault(month, {}).setdefault(kind, []).append(rec)
+                    ids[kind].add(rec.id)
+        archive.seal(through, sealed)
+        store.remove(ids)
+        rebuild_indexes()
+    app.logger.info("Sealed %s months through %s", len(sealed), through)
+    return sorted(sealed)
+
+@app.cli.command("seal-periods")
+@click.option("--through", default="", help="Last month to seal, YYYY-MM (default: last month).")
+def seal_periods_command(through):
+    """Seal every month up to THROUGH into read-only archive segments."""
+    if STORAGE_BACKEND == "sqlite":
+        raise click.ClickException("Sealing periods needs the journal or json storage backend.")
+    if not through:
+        today = datetime.now()
+        through = f"{today.year - 1:04d}-12" if today.month == 1 else f"{today.year:04d}-{today.month - 1:02d}"
+    try:
+        through = datetime.strptime(through, "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        raise click.BadParameter("use YYYY-MM", param_hint="--through")
+    months = seal_periods(through)
+    click.echo(f"Sealed {len(months)} months; everything through {archive.sealed_through} is closed.")
+
+@app.cli.command("write-snapshot")
+@click.option("--format", "fmt", type=click.Choice(sorted(SNAPSHOT_FILES)), default=SNAPSHOT_FORMAT,
+              help="Snapshot format (default: SNAPSHOT_FORMAT).")
+@click.option("--output", type=click.Path(dir_okay=False, writable=True),
+              help="File to write (default: that format's snapshot file, which then becomes the one loaded).")
+def write_snapshot_command(fmt, output):
+    """Write the current records as a snapshot, e.g. to convert between formats."""
+    if STORAGE_BACKEND == "sqlite":
+        raise click.ClickException("Snapshots are written by the journal and json storage backends.")
+    output = output or SNAPSHOT_FILES[fmt]
+    with write_lock:
+        apply_sync()
+        write_snapshot(output, fmt, store.records, journal.seq)
+    click.echo(f"Wrote {sum(store.count(kind) for kind in RECORD_KINDS)} records to {output} ({fmt}).")
+
+# ---------------- Metrics ----------------
+@app.route("/metrics/writes")
+def write_metrics():
+    """Queue depth and flush latency of the write path, as JSON."""
+    return jsonify(write_queue.stats())
+
+def prometheus_labels(**labels):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Request latencies, record counts, data file sizes and write-path figures
+    in the Prometheus text format. Clients holding METRICS_TOKEN if it is set,
+    else loopback clients only, unless METRICS_ALLOW_REMOTE."""
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+            return "Forbidden", 403
+    elif not METRICS_ALLOW_REMOTE and request.remote_addr not in ("127.0.0.1", "::1"):
+        return "Forbidden", 403
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP busybig_{name} {help_text}")
+        lines.append(f"# TYPE busybig_{name} {kind}")
+        for suffix, labels, value in samples:
+            lines.append(f"busybig_{name}{suffix}{prometheus_labels(**labels) if labels else ''} {value}")
+
+    with request_metrics.lock:
+        latency = sorted((key, (list(h.counts), h.count, h.sum)) for key, h in request_metrics.latency.items())
+        responses = sorted(request_metrics.responses.items())
+        response_bytes = sorted(request_metrics.response_bytes.items())
+    samples = []
+    for (route, phase), (counts, count, total) in latency:
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+            cumulative += bucket_count
+            samples.append(("_bucket", dict(route=route, phase=phase, le=bound), cumulative))
+        samples.append(("_bucket", dict(route=route, phase=phase, le="+Inf"), count))
+        samples.append(("_sum", dict(route=route, phase=phase), total))
+        samples.append(("_count", dict(route=route, phase=phase), count))
+    metric("request_seconds", "histogram", "Request time per route, split into phases.", samples)
+    metric("responses_total", "counter", "Responses per route and status code.",
+           [("", dict(route=route, status=status), n) for (route, status), n in responses])
+    metric("response_bytes_total", "counter", "Bytes sent per route (streamed responses excluded).",
+           [("", dict(route=route), n) for route, n in response_bytes])
+    metric("records", "gauge", "Records per record list.",
+           [("", dict(kind=kind), store.count(kind)) for kind in RECORD_KINDS])
+    metric("data_file_bytes", "gauge", "Size of the files holding the records.",
+           [("", dict(file=os.path.basename(path)), file_size(path)) for path in (DATA_FILE, BINARY_SNAPSHOT_FILE, JOURNAL_FILE, SQLITE_FILE)])
+    stats = write_queue.stats()
+    metric("write_queue_depth", "gauge", "Records waiting for the group commit.", [("", None, stats["queue_depth"])])
+    metric("write_batches_total", "counter", "Batches of records committed.", [("", None, stats["batches"])])
+    metric("write_records_total", "counter", "Records committed.", [("", None, stats["records"])])
+    metric("write_flush_seconds_max", "gauge", "Longest commit of a batch.", [("", None, stats["max_flush_seconds"])])
+    metric("pdf_cache_bytes", "gauge", "Bytes of rendered PDFs held in the cache.", [("", None, pdf_cache.size)])
+    metric("response_cache_bytes", "gauge", "Bytes of rendered report pages held in the cache.",
+           [("", None, response_cache.size)])
+    return app.response_class("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
 # ---------------- For Deployment ----------------
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,297 @@
+"""Benchmark harness for the ledger app.
+
+Generates synthetic data.json files of several sizes, drives every route
+in-process through the Flask test client and reports latency percentiles,
+throughput, startup time and memory. Results can be saved as a baseline
+and later runs compared against it to catch regressions.
+
+    python benchmark.py --sizes 10000,100000 --save-baseline bench_baseline.json
+    python benchmark.py --sizes 10000,100000 --baseline bench_baseline.json
+
+Each size runs in its own process, against a copy of the app in a
+temporary directory, so the working data.json is never touched.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import date, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+# Share of each record list in a generated dataset.
+DEFAULT_MIX = {"sales_records": 0.5, "purchase_records": 0.3,
+               "sale_return_records": 0.1, "purchase_return_records": 0.1}
+
+
+# ---------------- Synthetic Data ----------------
+def generate_dataset(records, products=500, suppliers=50, days=3 * 365, start="2022-01-01", mix=None, seed=1):
+    """A dict in the data.json schema holding about `records` records.
+
+    Every product has a base price and a regular supplier; sales are marked
+    up from the base price, returns move a few units at a time, and dates
+    are spread evenly over `days` days from `start`.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    first_day = date.fromisoformat(start)
+    product_names = [f"Product {i:04d}" for i in range(products)]
+    supplier_names = [f"Supplier {i:03d}" for i in range(suppliers)]
+    base_price = {name: round(rng.uniform(1, 500), 2) for name in product_names}
+    supplier_of = {name: rng.choice(supplier_names) for name in product_names}
+
+    def day():
+        return (first_day + timedelta(days=rng.randrange(days))).isoformat()
+
+    data = {kind: [] for kind in DEFAULT_MIX}
+    for kind, share in mix.items():
+        for _ in range(int(records * share)):
+            product = rng.choice(product_names)
+            if kind in ("sales_records", "sale_return_records"):
+                unit_price = round(base_price[product] * rng.uniform(1.1, 1.5), 2)
+            else:
+                unit_price = base_price[product]
+            quantity = float(rng.randint(1, 5) if kind.endswith("return_records") else rng.randint(1, 40))
+            total = unit_price * quantity
+            if kind == "sales_records":
+                record = {"product_name": product, "sale_date": day(), "unit_price": unit_price,
+                          "quantity": quantity, "total_sale": total}
+            elif kind == "purchase_records":
+                record = {"supplier_name": supplier_of[product], "product_name": product, "purchase_date": day(),
+                          "unit_price": unit_price, "quantity": quantity, "total_purchase": total}
+            elif kind == "sale_return_records":
+                record = {"product_name": product, "return_date": day(), "unit_price": unit_price,
+                          "quantity": quantity, "refund_amount": total}
+            else:
+                record = {"supplier_name": supplier_of[product], "product_name": product, "return_date": day(),
+                          "unit_price": unit_price, "quantity": quantity, "total_return": total}
+            data[kind].append(record)
+    return data
+
+
+# ---------------- Routes ----------------
+def route_plan(rng, sales, products, suppliers, first_date, last_date):
+    """(name, request function) for every route; each call issues one request."""
+    def product():
+        return rng.choice(products)
+
+    def supplier():
+        return rng.choice(suppliers)
+
+    def sale_id():
+        return rng.randrange(max(sales, 1))
+
+    mid = first_date + (last_date - first_date) / 2
+    quarter = (mid.isoformat(), (mid + timedelta(days=90)).isoformat())
+    return [
+        ("GET /", lambda c: c.get("/")),
+        ("GET /sale", lambda c: c.get("/sale")),
+        ("GET /sale?search", lambda c: c.get("/sale", query_string={"search": product()[-3:]})),
+        ("GET /purchase?search", lambda c: c.get("/purchase", query_string={"search": supplier()[-2:]})),
+        ("GET /sale-return", lambda c: c.get("/sale-return")),
+        ("GET /purchase-return", lambda c: c.get("/purchase-return")),
+        ("POST /sale", lambda c: c.post("/sale", data={"product_name": product(), "sale_date": last_date.isoformat(),
+                                                        "unit_price": "10", "quantity": "2"})),
+        ("GET /profit", lambda c: c.get("/profit")),
+        ("POST /profit range", lambda c: c.post("/profit", data={"operating_expenses": "100",
+                                                                 "from": quarter[0], "to": quarter[1]})),
+        ("GET /cash-flow", lambda c: c.get("/cash-flow")),
+        ("GET /cash-flow-report", lambda c: c.get("/cash-flow-report")),
+        ("GET /cash-flow-report range", lambda c: c.get("/cash-flow-report",
+                                                         query_string={"from": quarter[0], "to": quarter[1]})),
+        ("GET /inventory", lambda c: c.get("/inventory")),
+        ("GET /inventory/<product>", lambda c: c.get(f"/inventory/{product()}")),
+        ("GET /supplier-ledger", lambda c: c.get("/supplier-ledger")),
+        ("GET /supplier-ledger/pdf", lambda c: c.get("/supplier-ledger/pdf")),
+        ("GET /supplier-ledger/<supplier>/pdf", lambda c: c.get(f"/supplier-ledger/{supplier()}/pdf")),
+        ("GET /invoice/<id>", lambda c: c.get(f"/invoice/{sale_id()}")),
+        ("GET /invoice/<id>/pdf", lambda c: c.get(f"/invoice/{sale_id()}/pdf")),
+        ("GET /analytics?group=product", lambda c: c.get("/analytics", query_string={"group": "product"})),
+        ("GET /export/sales range", lambda c: c.get("/export/sales",
+                                                    query_string={"from": quarter[0], "to": quarter[1]})),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def max_rss_mb():
+    """Peak resident set size of this process in MiB, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_worker(workdir, requests, seed):
+    """Benchmark the app copy in workdir; runs in a child process and returns the results."""
+    sys.path.insert(0, workdir)
+    # Time each route's own work, not hits on the rendered-response or PDF caches.
+    os.environ["RESPONSE_CACHE_MAX_BYTES"] = "0"
+    os.environ["PDF_CACHE_MAX_BYTES"] = "0"
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    import app
+    startup = time.perf_counter() - started
+    rss_loaded = max_rss_mb()
+
+    with open(os.path.join(workdir, "meta.json")) as f:
+        meta = json.load(f)
+    rng = random.Random(seed)
+    client = app.app.test_client()
+    plan = route_plan(rng, meta["sales"], meta["products"], meta["suppliers"],
+                      date.fromisoformat(meta["first_date"]), date.fromisoformat(meta["last_date"]))
+    routes = {}
+    for name, issue in plan:
+        issue(client).get_data()  # warm-up
+        timings = []
+        statuses = set()
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            response = issue(client)
+            response.get_data()
+            timings.append(time.perf_counter() - t0)
+            statuses.add(response.status_code)
+        timings.sort()
+        routes[name] = {
+            "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+            "p90_ms": round(percentile(timings, 0.90) * 1000, 3),
+            "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+            "max_ms": round(timings[-1] * 1000, 3),
+            "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+            "throughput_rps": round(len(timings) / sum(timings), 1) if sum(timings) else None,
+            "statuses": sorted(statuses),
+        }
+    return {
+        "records": meta["records"],
+        "data_file_mb": round(os.path.getsize(os.path.join(workdir, "data.json")) / (1024 * 1024), 1),
+        "startup_seconds": round(startup, 3),
+        "rss_mb": {"before_import": rss_before, "after_startup": rss_loaded, "peak": max_rss_mb()},
+        "routes": routes,
+    }
+
+
+# ---------------- Driver ----------------
+def prepare_workdir(records, args):
+    """A temporary copy of the app with a generated data.json of `records` records."""
+    workdir = tempfile.mkdtemp(prefix=f"busybig-bench-{records}-")
+    shutil.copy(os.path.join(BASE_DIR, "app.py"), workdir)
+    for folder in ("templates", "static"):
+        if os.path.isdir(os.path.join(BASE_DIR, folder)):
+            shutil.copytree(os.path.join(BASE_DIR, folder), os.path.join(workdir, folder))
+    data = generate_dataset(records, args.products, args.suppliers, args.days, args.start, seed=args.seed)
+    with open(os.path.join(workdir, "data.json"), "w") as f:
+        json.dump(data, f)
+    first_date = date.fromisoformat(args.start)
+    meta = {
+        "records": sum(len(rows) for rows in data.values()),
+        "sales": len(data["sales_records"]),
+        "products": sorted({rec["product_name"] for rec in data["purchase_records"] + data["sales_records"]}),
+        "suppliers": sorted({rec["supplier_name"] for rec in data["purchase_records"]}),
+        "first_date": first_date.isoformat(),
+        "last_date": (first_date + timedelta(days=args.days - 1)).isoformat(),
+    }
+    with open(os.path.join(workdir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return workdir
+
+
+def compare(results, baseline, tolerance, floor_ms):
+    """Regressions of results against baseline: p50/p90 slower by more than tolerance and floor_ms."""
+    regressions = []
+    for size, result in results.items():
+        base = baseline.get(size)
+        if base is None:
+            continue
+        for name, stats in result["routes"].items():
+            before = base["routes"].get(name)
+            if before is None:
+                continue
+            for key in ("p50_ms", "p90_ms"):
+                if stats[key] > before[key] * (1 + tolerance) and stats[key] - before[key] > floor_ms:
+                    regressions.append(f"{size} records, {name}: {key} {before[key]} -> {stats[key]}")
+        if result["startup_seconds"] > base["startup_seconds"] * (1 + tolerance) + floor_ms / 1000:
+            regressions.append(f"{size} records, startup: {base['startup_seconds']}s -> {result['startup_seconds']}s")
+    return regressions
+
+
+def print_report(size, result):
+    print(f"\n== {size} records ({result['data_file_mb']} MB data.json) ==")
+    print(f"startup {result['startup_seconds']}s, RSS after startup {result['rss_mb']['after_startup']} MB, "
+          f"peak {result['rss_mb']['peak']} MB")
+    print(f"{'route':40} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'req/s':>9}  status")
+    for name, stats in result["routes"].items():
+        print(f"{name:40} {stats['p50_ms']:9.2f} {stats['p90_ms']:9.2f} {stats['p99_ms']:9.2f} "
+              f"{stats['throughput_rps'] or 0:9.1f}  {','.join(map(str, stats['statuses']))}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated record counts.")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--suppliers", type=int, default=50)
+    parser.add_argument("--days", type=int, default=3 * 365, help="Date span of the generated records.")
+    parser.add_argument("--start", default="2022-01-01", help="First date of the generated records.")
+    parser.add_argument("--requests", type=int, default=20, help="Timed requests per route.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results here as JSON.")
+    parser.add_argument("--baseline", help="Compare against results saved earlier.")
+    parser.add_argument("--save-baseline", help="Save the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging, as a fraction.")
+    parser.add_argument("--floor-ms", type=float, default=1.0, help="Ignore slowdowns smaller than this.")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary app copies.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        json.dump(run_worker(args.worker, args.requests, args.seed), sys.stdout)
+        return 0
+
+    results = {}
+    for size in [int(value) for value in args.sizes.split(",") if value]:
+        workdir = prepare_workdir(size, args)
+        try:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", workdir,
+                                     "--requests", str(args.requests), "--seed", str(args.seed)],
+                                    cwd=workdir, check=True, capture_output=True, text=True).stdout
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        results[str(size)] = json.loads(output)
+        print_report(size, results[str(size)])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.floor_ms)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import importlib.util
+import io
+import json
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def load_app(directory, name):
+    """Import a copy of app.py living in directory, so its data files go there."""
+    spec = importlib.util.spec_from_file_location(name, directory / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND", "json")
+    shutil.copy(REPO / "app.py", tmp_path)
+    shutil.copytree(REPO / "templates", tmp_path / "templates")
+    shutil.copytree(REPO / "static", tmp_path / "static")
+    return tmp_path
+
+
+def test_import_rejects_non_text_date(app_dir):
+    app = load_app(app_dir, "app_import_first")
+    client = app.app.test_client()
+    line = {"product_name": "X", "sale_date": 20240101, "unit_price": 1, "quantity": 2}
+    response = client.post("/import/sales?format=jsonl", data=io.BytesIO(json.dumps(line).encode()))
+    assert response.status_code == 400
+    assert response.get_json()["errors"] == ["line 1: names and dates must be text"]
+    assert app.store.count("sales_records") == 0
+
+    response = client.post("/sale", data={"product_name": "Y", "sale_date": "2024-01-01",
+                                          "unit_price": "1", "quantity": "2"})
+    assert response.status_code == 200
+    with open(app_dir / "data.json") as f:
+        assert [rec["sale_date"] for rec in json.load(f)["sales_records"]] == ["2024-01-01"]
+
+    reloaded = load_app(app_dir, "app_import_second")
+    assert [rec.product_name for rec in reloaded.store.all("sales_records")] == ["Y"]
+
+
+def test_failed_append_leaves_store_unchanged(app_dir):
+    app = load_app(app_dir, "app_import_rollback")
+    good = app.make_record("sales_records", {"product_name": "Good", "sale_date": "2024-01-01",
+                                             "unit_price": 1.0, "quantity": 1.0, "total_sale": 1.0})
+    bad = app.make_record("sales_records", {"product_name": "Bad", "sale_date": 20240101,
+                                            "unit_price": 1.0, "quantity": 1.0, "total_sale": 1.0})
+    with app.write_lock, pytest.raises(TypeError):
+        app.store.append_many([("sales_records", good), ("sales_records", bad)])
+    assert app.store.count("sales_records") == 0
+    assert app.store.page("sales_records", "good", None, None, 10)["records"] == []
+
+    with app.write_lock:
+        app.store.append_many([("sales_records", good)])
+    assert [rec.id for rec in app.store.all("sales_records")] == [0]
+    assert app.store.page("sales_records", "good", None, None, 10)["records"] == [good]